@@ -0,0 +1,146 @@
+from typing import Any, AsyncIterable, Awaitable, Callable, Iterable, List, Optional, Union
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.types import InlineKeyboardMarkup
+
+from app.config.bot import BROADCAST_CHAT_RATE, BROADCAST_RATE, BROADCAST_WORKERS
+
+from .ratelimit import RateLimiter, Throughput, call_limited, run_pool
+
+# Shared by all broadcasts, so that running several at once stays within the Bot API limits
+broadcast_limiter = RateLimiter(rate=BROADCAST_RATE, chat_rate=BROADCAST_CHAT_RATE)
+
+
+class Delivery:
+    """
+    One message of a broadcast and its outcome
+    """
+
+    __slots__ = ("chat_id", "text", "reply_markup", "key", "message_id", "error")
+
+    def __init__(
+        self,
+        chat_id: Optional[int],
+        text: str,
+        reply_markup: Optional[InlineKeyboardMarkup] = None,
+        key: Any = None,
+    ) -> None:
+        """
+        :param chat_id: recipient chat
+        :param text: message text
+        :param reply_markup: message keyboard
+        :param key: caller's reference to the recipient, e.g. a row pk
+        """
+        self.chat_id = chat_id
+        self.text = text
+        self.reply_markup = reply_markup
+        self.key = key
+        self.message_id: Optional[int] = None
+        self.error: Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.message_id is not None
+
+    @property
+    def unreachable(self) -> bool:
+        """
+        The user blocked the bot or never started it, so further messages fail too
+        """
+        if isinstance(self.error, TelegramForbiddenError):
+            return True
+        return isinstance(self.error, TelegramBadRequest) and "chat not found" in self.error.message.lower()
+
+    def __repr__(self) -> str:
+        return f"Delivery(chat_id={self.chat_id}, key={self.key}, message_id={self.message_id}, error={self.error!r})"
+
+
+class BroadcastReport:
+    def __init__(self, deliveries: List[Delivery], stats: Throughput) -> None:
+        self.deliveries = deliveries
+        self.stats = stats
+
+    @property
+    def sent(self) -> List[Delivery]:
+        return [delivery for delivery in self.deliveries if delivery.ok]
+
+    @property
+    def failed(self) -> List[Delivery]:
+        return [delivery for delivery in self.deliveries if not delivery.ok]
+
+
+class Broadcast:
+    """
+    Sends messages to many chats with a pool of workers.
+
+    Requests share the global broadcast limiter, TelegramRetryAfter pauses it
+    and the message is sent again. Any other error is the outcome of its delivery.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        message_type: Optional[str] = None,
+        limiter: RateLimiter = broadcast_limiter,
+        workers: int = BROADCAST_WORKERS,
+    ) -> None:
+        """
+        :param bot: bot instance
+        :param message_type: MessageToDelete type of the sent messages, None to keep them
+        :param limiter: rate limiter of the requests
+        :param workers: number of concurrent requests
+        """
+        self.bot = bot
+        self.message_type = message_type
+        self.limiter = limiter
+        self.workers = workers
+
+    async def _send(self, delivery: Delivery) -> None:
+        from .utils import Utils
+
+        try:
+            if delivery.chat_id is None:
+                raise ValueError("Recipient has no chat")
+            bot_msg = await call_limited(
+                self.limiter,
+                lambda: self.bot.send_message(
+                    chat_id=delivery.chat_id, text=delivery.text, reply_markup=delivery.reply_markup
+                ),
+                chat_id=delivery.chat_id,
+            )
+        except Exception as e:
+            delivery.error = e
+            raise
+        delivery.message_id = bot_msg.message_id
+        if self.message_type:
+            await Utils.add_message_to_delete(
+                message_id=bot_msg.message_id, chat_id=bot_msg.chat.id, message_type=self.message_type
+            )
+
+    async def send(
+        self,
+        deliveries: Union[Iterable[Delivery], AsyncIterable[Delivery]],
+        on_result: Optional[Callable[[Delivery], Awaitable[None]]] = None,
+        name: str = "broadcast",
+    ) -> BroadcastReport:
+        """
+        Send all deliveries and report the outcome of each one
+
+        :param deliveries: messages to send
+        :param on_result: coroutine function called with each finished delivery
+        :param name: name used in the throughput report
+        :return: report with the outcome of every delivery
+        """
+        done: List[Delivery] = []
+
+        async def send(delivery: Delivery) -> None:
+            try:
+                await self._send(delivery)
+            finally:
+                done.append(delivery)
+                if on_result is not None:
+                    await on_result(delivery)
+
+        stats = await run_pool(deliveries, send, limiter=None, workers=self.workers, name=name)
+        return BroadcastReport(done, stats)
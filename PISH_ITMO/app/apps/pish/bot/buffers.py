@@ -0,0 +1,116 @@
+import asyncio
+import datetime
+import logging
+from typing import Iterable, List, Optional, Set
+
+from app.config.bot import MESSAGE_BUFFER_INTERVAL, MESSAGE_BUFFER_SIZE
+
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+
+class MessageToDeleteBuffer:
+    """
+    Collects MessageToDelete rows and inserts them with one query,
+    deletions of rows requested with delete() are saved the same way.
+
+    Rows are flushed once max_size of them are collected or flush_interval
+    seconds after the first one was added, whichever comes first.
+    """
+
+    def __init__(self, max_size: int = 500, flush_interval: float = 2.0) -> None:
+        """
+        :param max_size: number of rows that triggers a flush
+        :param flush_interval: maximum delay of a row in seconds
+        """
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self._rows: List[models.MessageToDelete] = []
+        # Rows being inserted right now, not visible to other queries yet
+        self._flushing: List[models.MessageToDelete] = []
+        self._deleted: Set[int] = set()
+        self._timer: Optional[asyncio.Task] = None
+        # Inserts and deletes of two flushes must not interleave
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    async def add(
+        self, message_id: int, chat_id: int, message_type: str, expires_at: Optional[datetime.datetime] = None
+    ) -> None:
+        self._rows.append(
+            models.MessageToDelete(id=message_id, chat_id=chat_id, type=message_type, expires_at=expires_at)
+        )
+        if len(self._rows) >= self.max_size:
+            await self.flush()
+        else:
+            self._schedule_flush()
+
+    def delete(self, message_ids: Iterable[int]) -> None:
+        """
+        Delete rows of the given messages, buffered rows are just dropped
+        """
+        message_ids = set(message_ids)
+        buffered = {row.id for row in self._rows if row.id in message_ids}
+        if buffered:
+            self._rows = [row for row in self._rows if row.id not in buffered]
+        self._deleted |= message_ids - buffered
+        if self._deleted:
+            self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        if self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        self._timer = None
+        await self.flush()
+
+    def pop(self, chat_id: int, message_types: Iterable[str]) -> List[int]:
+        """
+        Take the buffered rows of a chat out of the buffer.
+        Rows of a running flush are reported too, they are deleted by the next flush
+
+        :return: ids of the taken messages
+        """
+        message_types = set(message_types)
+        taken, kept = [], []
+        for row in self._rows:
+            (taken if row.chat_id == chat_id and row.type in message_types else kept).append(row)
+        self._rows = kept
+        inserting = {row.id for row in self._flushing if row.chat_id == chat_id and row.type in message_types}
+        if inserting:
+            # The next flush waits for the running one, so the rows are inserted by then
+            self._deleted |= inserting
+            self._schedule_flush()
+        return [row.id for row in taken] + list(inserting)
+
+    async def flush(self) -> None:
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+            self._timer = None
+        rows, self._rows = self._rows, []
+        deleted, self._deleted = self._deleted, set()
+        if not rows and not deleted:
+            return
+        self._flushing += rows
+        async with self._lock:
+            try:
+                if rows:
+                    await models.MessageToDelete.objects.abulk_create(rows, ignore_conflicts=True)
+                if deleted:
+                    await models.MessageToDelete.objects.filter(pk__in=deleted).adelete()
+            except Exception:
+                logger.exception("Failed to save %d messages to delete and %d deletions", len(rows), len(deleted))
+            finally:
+                flushed = set(map(id, rows))
+                self._flushing = [row for row in self._flushing if id(row) not in flushed]
+
+    async def close(self) -> None:
+        await self.flush()
+
+
+message_buffer = MessageToDeleteBuffer(max_size=MESSAGE_BUFFER_SIZE, flush_interval=MESSAGE_BUFFER_INTERVAL)
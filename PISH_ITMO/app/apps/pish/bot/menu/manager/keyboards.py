@@ -11,6 +11,10 @@ confirm_button = InlineKeyboardButton(
     text="Подтвердить ✅", callback_data="confirm"
 )
 
+cancel_broadcast_button = InlineKeyboardButton(
+    text="Отменить рассылку ❌", callback_data="cancel_broadcast"
+)
+
 continue_button = InlineKeyboardButton(
     text="Продолжить ➡️", callback_data="notif_person"
 )
@@ -53,3 +57,7 @@ person_confirm: InlineKeyboardMarkup = InlineKeyboardMarkup(
 send_confirm: InlineKeyboardMarkup = InlineKeyboardMarkup(
     inline_keyboard=[[confirm_button], [back_button]]
 )
+
+cancel_broadcast: InlineKeyboardMarkup = InlineKeyboardMarkup(
+    inline_keyboard=[[cancel_broadcast_button]]
+)
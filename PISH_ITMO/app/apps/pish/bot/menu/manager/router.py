@@ -1,10 +1,12 @@
 from asyncio import sleep
+from contextlib import suppress
 
-from aiogram import Router, types, Bot
+from aiogram import Router, types, Bot, Dispatcher
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import or_f
 from aiogram.filters.text import Text
 from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseEventIsolation
 from aiogram.types import InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
@@ -14,7 +16,9 @@ from . import text
 from ..keyboards import manager_menu as kb_manager_menu
 from ..router import Menu
 from ..text import manager_menu as text_manager_menu
-from ...utils import Notification, User
+from ...outbox import Progress, outbox
+from ...registry import menu_renderer
+from ...utils import Notification, User, Utils
 
 # Router Start
 router = Router()
@@ -202,7 +206,7 @@ async def notif_message(message: types.Message, state: FSMContext, bot: Bot) ->
 
 
 @router.callback_query(Text(text="confirm"), Menu.Manager.notif_send)
-async def notif_send(callback: types.CallbackQuery, state: FSMContext, bot: Bot) -> None:
+async def notif_send(callback: types.CallbackQuery, state: FSMContext, bot: Bot, dispatcher: Dispatcher) -> None:
     state_data = await state.get_data()
     notif_data = state_data.get("notif_data", ":")
     if not isinstance(notif_data, list):
@@ -219,16 +223,88 @@ async def notif_send(callback: types.CallbackQuery, state: FSMContext, bot: Bot)
         notif_text = text.feedback_message
 
     await callback.message.edit_text(text=text.sending_in_process)
-    send_count = await Notification.send_notifs_by_manager(notif_type=notif_type, bot=bot,
-                                                           pk=notif_pk, notif_text=notif_text)
-    await callback.message.edit_text(
-        text=text.sending_success.format(send_count=send_count)
-    )
+    job = await Notification.create_job_by_manager(notif_type=notif_type, pk=notif_pk, notif_text=notif_text)
+    await state.update_data({"broadcast_job": job.pk})
+    await state.set_state(Menu.Manager.notif_progress)
+
+    # The handler returns right away, the broadcast writes the FSM directly once it is over
+    outbox.spawn(run_broadcast(
+        bot=bot,
+        job=job,
+        chat_id=callback.message.chat.id,
+        message_id=callback.message.message_id,
+        state=FSMContext(bot=bot, storage=state.storage, key=state.key),
+        isolation=dispatcher.fsm.events_isolation,
+    ))
+
+
+@router.callback_query(Text(text="cancel_broadcast"), Menu.Manager.notif_progress)
+async def cancel_broadcast(callback: types.CallbackQuery, state: FSMContext) -> None:
+    job_id = (await state.get_data()).get("broadcast_job")
+    if job_id:
+        await outbox.cancel(job_id)
+    await callback.answer(text=text.cancel_requested)
+
+
+async def run_broadcast(
+    bot: Bot,
+    job: models.BroadcastJob,
+    chat_id: int,
+    message_id: int,
+    state: FSMContext,
+    isolation: BaseEventIsolation,
+) -> None:
+    async def on_screen() -> bool:
+        # The manager may have left the broadcast screen, its message is then reused by the menu
+        return (
+            await state.get_state() == Menu.Manager.notif_progress.state
+            and (await state.get_data()).get("broadcast_job") == job.pk
+        )
+
+    async def show_progress(progress: Progress) -> None:
+        eta = ""
+        if progress.eta is not None:
+            minutes, seconds = divmod(round(progress.eta), 60)
+            eta = text.sending_eta.format(minutes=minutes, seconds=seconds)
+        async with isolation.lock(bot=bot, key=state.key):
+            if not await on_screen():
+                return
+            with suppress(TelegramBadRequest):
+                await bot.edit_message_text(
+                    text=text.sending_progress.format(
+                        sent=progress.sent, failed=progress.failed, remaining=progress.remaining, eta=eta
+                    ),
+                    reply_markup=kb.cancel_broadcast,
+                    chat_id=chat_id,
+                    message_id=message_id
+                )
+
+    job = await Notification.run_job(bot=bot, job=job, on_progress=show_progress)
+    if job.status == models.BroadcastJob.Status.CANCELED:
+        result_text = text.sending_canceled.format(send_count=job.sent_count)
+    else:
+        result_text = text.sending_success.format(send_count=job.sent_count)
+    if job.skipped:
+        result_text += text.sending_skipped.format(skipped=job.skipped)
+
+    async with isolation.lock(bot=bot, key=state.key):
+        if not await on_screen():
+            bot_msg = await bot.send_message(chat_id=chat_id, text=result_text)
+            await Utils.add_message_to_delete(message_id=bot_msg.message_id, chat_id=chat_id, message_type="general")
+            return
+        with suppress(TelegramBadRequest):
+            await bot.edit_message_text(text=result_text, chat_id=chat_id, message_id=message_id)
     await sleep(5)
 
-    await state.update_data({"notif_data": "", "notif_text": "", "manager_msg_id": "", "selection": ""})
-    await state.set_state(Menu.Manager.general)
-    try:
-        await callback.message.edit_text(text=text_manager_menu, reply_markup=kb_manager_menu)
-    except TelegramBadRequest:
-        pass
+    async with isolation.lock(bot=bot, key=state.key):
+        if not await on_screen():
+            return
+        menu_renderer.forget(chat_id=chat_id, message_id=message_id)
+        await state.update_data(
+            {"notif_data": "", "notif_text": "", "manager_msg_id": "", "selection": "", "broadcast_job": ""}
+        )
+        await state.set_state(Menu.Manager.general)
+        with suppress(TelegramBadRequest):
+            await bot.edit_message_text(
+                text=text_manager_menu, reply_markup=kb_manager_menu, chat_id=chat_id, message_id=message_id
+            )
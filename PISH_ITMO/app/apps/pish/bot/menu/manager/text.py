@@ -38,7 +38,17 @@ type_names = {
 
 send_confirm = "Ты хочешь отправить сообщение <b>{name}</b> следующего содержания:\n\n"
 sending_in_process = "Идет процесс рассылки, ожидайте сообщение о его завершении"
+sending_progress = (
+    "Идет процесс рассылки\n\n"
+    "Доставлено: <b>{sent}</b>\n"
+    "Не доставлено: <b>{failed}</b>\n"
+    "Осталось: <b>{remaining}</b>{eta}"
+)
+sending_eta = "\nПримерно {minutes} мин. {seconds} сек. до завершения"
 sending_success = "{send_count} человек успешно получили рассылку"
+sending_canceled = "Рассылка отменена, {send_count} человек успели её получить"
+sending_skipped = "\n{skipped} человек пропущено: они не запускали бота или заблокировали его"
+cancel_requested = "Рассылка будет остановлена"
 
 feedback_message = "Вы только что посетили мероприятие <b>{name}</b>. Мы просим вас ответить на несколько вопросов."
 
@@ -12,7 +12,8 @@ from django.db.models import QuerySet
 
 from . import keyboards as kb
 from . import text
-from ..utils import User, Utils, SpamFilter, Transfer, Living, or_f_list, Notification
+from ..registry import menu_renderer
+from ..utils import User, Utils, Transfer, Living, or_f_list, Notification
 from ... import models
 
 router = Router()
@@ -56,34 +57,30 @@ class Menu(StatesGroup):
         notif_message = State()
         notif_confirm = State()
         notif_send = State()
+        notif_progress = State()
 
 
 # User Menu
-@router.message(Text(text=text.menu_button), SpamFilter(), Menu())
+@router.message(Text(text=text.menu_button), Menu())
 async def user_menu(message: types.Message, state: FSMContext, bot: Bot):
     await message.delete()
-    await Utils.delete_message_by_type(chat_id=message.chat.id, message_types=["imenu"], bot=bot)
     user_status = await User.get_user_status(tg_id=message.from_user.id)
 
     if user_status == "user":
         await state.set_state(Menu.User.general)
-        bot_msg = await message.answer(text=text.user_menu, reply_markup=kb.user_menu)
-        await Utils.add_message_to_delete(message_id=bot_msg.message_id, chat_id=bot_msg.chat.id, message_type="imenu")
+        await menu_renderer.render(bot, message, "imenu", text=text.user_menu, reply_markup=kb.user_menu)
 
     elif user_status == "listener":
         await state.set_state(Menu.Listener.general)
-        bot_msg = await message.answer(text=text.listener_menu, reply_markup=kb.listener_menu)
-        await Utils.add_message_to_delete(message_id=bot_msg.message_id, chat_id=bot_msg.chat.id, message_type="imenu")
+        await menu_renderer.render(bot, message, "imenu", text=text.listener_menu, reply_markup=kb.listener_menu)
 
     elif user_status == "expert":
         await state.set_state(Menu.Expert.general)
-        bot_msg = await message.answer(text=text.expert_menu, reply_markup=kb.expert_menu)
-        await Utils.add_message_to_delete(message_id=bot_msg.message_id, chat_id=bot_msg.chat.id, message_type="imenu")
+        await menu_renderer.render(bot, message, "imenu", text=text.expert_menu, reply_markup=kb.expert_menu)
 
     elif user_status == "manager":
         await state.set_state(Menu.Manager.general)
-        bot_msg = await message.answer(text=text.manager_menu, reply_markup=kb.manager_menu)
-        await Utils.add_message_to_delete(message_id=bot_msg.message_id, chat_id=bot_msg.chat.id, message_type="imenu")
+        await menu_renderer.render(bot, message, "imenu", text=text.manager_menu, reply_markup=kb.manager_menu)
 
 
 @router.callback_query(Text(text="back"), Menu.transfer_info)
@@ -249,6 +246,14 @@ async def feedback_step(callback: types.CallbackQuery, state: FSMContext):
 
 
 @router.message(invert_f(or_f_list(Menu.Manager.notif_person_confirm, Menu.Manager.notif_message)))
-async def message_delete(message: types.Message) -> None:
+async def message_delete(message: types.Message, raw_state: str | None) -> None:
     with suppress(TelegramBadRequest):
         await message.delete()
+    # Idle states are swept from the storage, the user has to start over
+    if raw_state is None:
+        bot_msg = await message.answer(text=text.session_expired)
+        await Utils.add_message_to_delete(
+            message_id=bot_msg.message_id,
+            chat_id=bot_msg.chat.id,
+            message_type="general"
+        )
@@ -52,3 +52,4 @@ feedback_answer = {
 
 feedback_final = "Спасибо за прохождение опроса! Ваше мнение ценно для нас!"
 
+session_expired = "Сессия истекла, отправь /start, чтобы вернуться в меню"
@@ -0,0 +1,27 @@
+from typing import Any, Dict, List, Union
+
+from aiogram import Bot
+from aiogram.methods.base import Request, TelegramMethod
+
+
+class DeleteMessages(TelegramMethod[bool]):
+    """
+    Use this method to delete multiple messages simultaneously.
+    Messages that can't be found or deleted are skipped.
+
+    Not available in the pinned aiogram version.
+
+    Source: https://core.telegram.org/bots/api#deletemessages
+    """
+
+    __returning__ = bool
+
+    chat_id: Union[int, str]
+    """Unique identifier for the target chat or username of the target channel"""
+    message_ids: List[int]
+    """Identifiers of 1-100 messages to delete"""
+
+    def build_request(self, bot: Bot) -> Request:
+        data: Dict[str, Any] = self.dict()
+
+        return Request(method="deleteMessages", data=data)
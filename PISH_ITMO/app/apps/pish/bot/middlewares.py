@@ -0,0 +1,309 @@
+import copy
+import logging
+import time
+from contextlib import suppress
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import StateType
+from aiogram.methods import (
+    DeleteMessage,
+    EditMessageCaption,
+    EditMessageMedia,
+    EditMessageReplyMarkup,
+    EditMessageText,
+    TelegramMethod,
+)
+from aiogram.methods.base import TelegramType
+from aiogram.types import CallbackQuery, TelegramObject, Update
+
+from .cache import MISSING, TTLCache
+from .methods import DeleteMessages
+from .registry import menu_renderer
+from .utils import Utils
+
+logger = logging.getLogger(__name__)
+
+NOT_MODIFIED = (
+    "Bad Request: message is not modified: specified new message content and reply markup "
+    "are exactly the same as a current content and reply markup of the message"
+)
+
+
+class BufferedFSMContext(FSMContext):
+    """
+    FSM context that keeps state and data writes in memory until flush()
+    """
+
+    def __init__(self, context: FSMContext) -> None:
+        super().__init__(bot=context.bot, storage=context.storage, key=context.key)
+        self._state: Any = MISSING
+        self._data: Optional[Dict[str, Any]] = None
+        # Keys changed by update_data since the data was last replaced
+        self._patch: Dict[str, Any] = {}
+        self._replaced = False
+
+    @property
+    def dirty(self) -> bool:
+        return self._state is not MISSING or self._replaced or bool(self._patch)
+
+    async def set_state(self, state: StateType = None) -> None:
+        self._state = state.state if isinstance(state, State) else state
+
+    async def get_state(self) -> Optional[str]:
+        if self._state is not MISSING:
+            return self._state
+        return await super().get_state()
+
+    async def set_data(self, data: Dict[str, Any]) -> None:
+        self._data = copy.deepcopy(data)
+        self._patch = {}
+        self._replaced = True
+
+    async def get_data(self) -> Dict[str, Any]:
+        if self._data is None:
+            self._data = await super().get_data()
+        return copy.deepcopy(self._data)
+
+    async def update_data(self, data: Optional[Dict[str, Any]] = None, **kwargs: Any) -> Dict[str, Any]:
+        if data:
+            kwargs.update(data)
+        if self._data is None:
+            self._data = await super().get_data()
+        self._data.update(copy.deepcopy(kwargs))
+        if not self._replaced:
+            self._patch.update(copy.deepcopy(kwargs))
+        return copy.deepcopy(self._data)
+
+    async def flush(self) -> None:
+        """
+        Write buffered changes with as few storage operations as possible
+        """
+        if not self.dirty:
+            return
+        state_changed = self._state is not MISSING
+        data_changed = self._replaced or bool(self._patch)
+
+        if state_changed and data_changed and hasattr(self.storage, "set_record"):
+            await self.storage.set_record(bot=self.bot, key=self.key, state=self._state, data=self._data)
+        else:
+            if state_changed:
+                await self.storage.set_state(bot=self.bot, key=self.key, state=self._state)
+            if self._replaced:
+                await self.storage.set_data(bot=self.bot, key=self.key, data=self._data)
+            elif self._patch:
+                await self.storage.update_data(bot=self.bot, key=self.key, data=self._patch)
+
+        self._state = MISSING
+        self._patch = {}
+        self._replaced = False
+
+
+class FSMWriteBufferMiddleware(BaseMiddleware):
+    """
+    Coalesces FSM writes made while handling one update into a single flush.
+
+    Must be registered as an outer update middleware after the dispatcher's
+    FSM middleware, so the flush happens inside the events isolation lock.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        context = data.get("state")
+        if not isinstance(context, FSMContext):
+            return await handler(event, data)
+
+        buffered = BufferedFSMContext(context)
+        data["state"] = buffered
+        try:
+            result = await handler(event, data)
+        except Exception:
+            # Writes made before the error are kept, as they would be without the buffer
+            try:
+                await buffered.flush()
+            except Exception:
+                logger.exception("Failed to flush FSM writes of a failed update")
+            raise
+        await buffered.flush()
+        return result
+
+
+class AntiFloodMiddleware(BaseMiddleware):
+    """
+    Token bucket limiter for messages and callback queries of a user.
+
+    Keeps its state in memory only and must be registered as an outer update
+    middleware before the FSM middleware, so a rejected update never reaches
+    the storage, filters or handlers.
+    """
+
+    warning_text = "Антифлуд система!\nПодождите 60 секунд."
+
+    def __init__(self, rate: float = 0.5, burst: int = 8, cooldown: float = 60, maxsize: int = 10000) -> None:
+        """
+        :param rate: tokens restored per second
+        :param burst: bucket capacity, number of events allowed in a row
+        :param cooldown: ban duration in seconds once the bucket is empty
+        :param maxsize: maximum number of tracked users
+        """
+        self.rate = rate
+        self.burst = burst
+        self.cooldown = cooldown
+        # An entry may be dropped once its bucket would be full again and its ban is over
+        self._buckets = TTLCache(maxsize=maxsize, ttl=max(cooldown, burst / rate))
+        # Users with a warning in the chat, it is deleted on their first allowed event
+        self._warned = TTLCache(maxsize=maxsize, ttl=24 * 60 * 60)
+
+    def _consume(self, user_id: int) -> str:
+        """
+        Take a token from the bucket of the user
+
+        :return: "allow", "ban" (the ban has just started) or "drop"
+        """
+        now = time.monotonic()
+        # [tokens, updated_at, banned_until]
+        bucket: Optional[List[float]] = self._buckets.get(user_id, None)
+        if bucket is None:
+            bucket = [float(self.burst), now, 0.0]
+        self._buckets.set(user_id, bucket)
+
+        tokens, updated_at, banned_until = bucket
+        if now < banned_until:
+            return "drop"
+        if banned_until:
+            tokens, updated_at = float(self.burst), now
+
+        tokens = min(float(self.burst), tokens + (now - updated_at) * self.rate)
+        if tokens < 1:
+            bucket[:] = [tokens, now, now + self.cooldown]
+            return "ban"
+        bucket[:] = [tokens - 1, now, 0.0]
+        return "allow"
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if not isinstance(event, Update) or user is None or not (event.message or event.callback_query):
+            return await handler(event, data)
+
+        verdict = self._consume(user.id)
+        bot: Bot = data["bot"]
+        chat = data.get("event_chat")
+
+        if verdict == "allow":
+            warned_chat_id = self._warned.pop(user.id)
+            if warned_chat_id is not None:
+                await Utils.delete_message_by_type(chat_id=warned_chat_id, message_types=["flood"], bot=bot)
+            return await handler(event, data)
+
+        with suppress(TelegramAPIError):
+            if event.message:
+                await event.message.delete()
+            else:
+                await event.callback_query.answer()
+        if verdict == "ban" and chat is not None:
+            with suppress(TelegramAPIError):
+                flood_msg = await bot.send_message(chat_id=chat.id, text=self.warning_text)
+                self._warned.set(user.id, chat.id)
+                await Utils.add_message_to_delete(
+                    message_id=flood_msg.message_id,
+                    chat_id=flood_msg.chat.id,
+                    message_type="flood"
+                )
+        return None
+
+
+class MenuCallbackMiddleware(BaseMiddleware):
+    """
+    Callback handlers edit menu messages directly, so the rendered fingerprint
+    of a message is dropped whenever a callback query comes from it.
+
+    Must be registered as an outer callback query middleware.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if isinstance(event, CallbackQuery) and event.message:
+            menu_renderer.forget(chat_id=event.message.chat.id, message_id=event.message.message_id)
+        return await handler(event, data)
+
+
+class SkipUnmodifiedEditsMiddleware(BaseRequestMiddleware):
+    """
+    Bot session middleware failing editMessageText calls that would not change
+    the message without a request, with the error Telegram would answer them with.
+
+    Fingerprints of the last text and markup of edited messages are kept in a
+    bounded LRU, other edits and deletions of a message drop its fingerprint.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 24 * 60 * 60) -> None:
+        """
+        :param maxsize: maximum number of tracked messages
+        :param ttl: lifetime of a fingerprint in seconds
+        """
+        self._fingerprints = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.skipped = 0
+
+    @staticmethod
+    def _key(method: TelegramMethod[Any]) -> Any:
+        inline_message_id = getattr(method, "inline_message_id", None)
+        return inline_message_id if inline_message_id is not None else (method.chat_id, method.message_id)
+
+    @staticmethod
+    def _fingerprint(method: EditMessageText) -> int:
+        return hash((
+            method.text,
+            method.parse_mode,
+            tuple(entity.json() for entity in method.entities or ()),
+            method.disable_web_page_preview,
+            method.reply_markup.json(exclude_none=True) if method.reply_markup else None,
+        ))
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> TelegramType:
+        if isinstance(method, DeleteMessages):
+            for message_id in method.message_ids:
+                self._fingerprints.pop((method.chat_id, message_id))
+        elif isinstance(method, (DeleteMessage, EditMessageReplyMarkup, EditMessageCaption, EditMessageMedia)):
+            self._fingerprints.pop(self._key(method))
+        if not isinstance(method, EditMessageText):
+            return await make_request(bot, method)
+
+        key = self._key(method)
+        fingerprint = self._fingerprint(method)
+        if self._fingerprints.get(key, None) == fingerprint:
+            self.skipped += 1
+            # Callers of edits already suppress this error, and a faked result could not be a full Message
+            raise TelegramBadRequest(method=method, message=NOT_MODIFIED)
+
+        try:
+            response = await make_request(bot, method)
+        except TelegramBadRequest as e:
+            if "message is not modified" in e.message:
+                self._fingerprints.set(key, fingerprint)
+            else:
+                self._fingerprints.pop(key)
+            raise
+        self._fingerprints.set(key, fingerprint)
+        return response
@@ -0,0 +1,312 @@
+import asyncio
+import logging
+import time
+from contextlib import suppress
+from typing import AsyncIterable, Awaitable, Callable, Coroutine, Iterable, List, Optional, Set, Union
+
+from aiogram import Bot
+from aiogram.types import InlineKeyboardMarkup
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from app.config.bot import BROADCAST_PROGRESS_INTERVAL, OUTBOX_BATCH_SIZE, OUTBOX_CLAIM_SIZE
+
+from .broadcast import Broadcast, Delivery
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+Status = models.BroadcastDelivery.Status
+
+
+class Progress:
+    """
+    Delivery counters of a running job
+    """
+
+    __slots__ = ("total", "sent", "failed", "_done_before", "_started_at")
+
+    def __init__(self, total: int, sent: int = 0, failed: int = 0) -> None:
+        """
+        :param total: number of deliveries of the job
+        :param sent: deliveries sent before this run
+        :param failed: deliveries failed before this run
+        """
+        self.total = total
+        self.sent = sent
+        self.failed = failed
+        self._done_before = sent + failed
+        self._started_at = time.monotonic()
+
+    @property
+    def remaining(self) -> int:
+        return self.total - self.sent - self.failed
+
+    @property
+    def eta(self) -> Optional[float]:
+        """
+        Seconds left at the rate of this run, None until something is sent
+        """
+        done = self.sent + self.failed - self._done_before
+        if not done:
+            return None
+        return self.remaining * (time.monotonic() - self._started_at) / done
+
+
+class Outbox:
+    """
+    Broadcasts stored in the database before they are sent.
+
+    A job and a delivery row per recipient are created up front, the consumer
+    sends pending deliveries in batches. A delivery is marked as sending before
+    its request, so after a crash it is reported as failed instead of being sent twice.
+    """
+
+    def __init__(self, batch_size: int = 500, claim_size: int = 50) -> None:
+        """
+        :param batch_size: number of deliveries inserted at once
+        :param claim_size: number of deliveries marked as sending at once
+        """
+        self.batch_size = batch_size
+        self.claim_size = claim_size
+        self._tasks: Set[asyncio.Task] = set()
+        # Ids of the jobs sent by this process and of the ones among them asked to stop
+        self._running: Set[int] = set()
+        self._canceled: Set[int] = set()
+
+    async def create_job(
+        self,
+        notif_type: str,
+        deliveries: Union[Iterable[Delivery], AsyncIterable[Delivery]],
+        text: str = "",
+        reply_markup: Optional[InlineKeyboardMarkup] = None,
+        message_type: str = "",
+        object_id: Optional[int] = None,
+    ) -> models.BroadcastJob:
+        """
+        Save a broadcast, deliveries without their own text get the job text.
+        Deliveries without a chat are counted in job.skipped and not saved
+
+        :param notif_type: kind of the notification, used to report the result
+        :param deliveries: recipients, Delivery.key is saved as the delivery object_id
+        :param text: text of the messages
+        :param reply_markup: keyboard of the messages
+        :param message_type: MessageToDelete type of the sent messages
+        :param object_id: entity the notification is about
+        :return: the job
+        """
+        job = await models.BroadcastJob.objects.acreate(
+            notif_type=notif_type,
+            object_id=object_id,
+            message_type=message_type,
+            text=text,
+            reply_markup=reply_markup.dict(exclude_none=True) if reply_markup else None,
+        )
+
+        batch = []
+        skipped = 0
+
+        async def save():
+            await models.BroadcastDelivery.objects.abulk_create(batch)
+            batch.clear()
+
+        async def add(delivery: Delivery):
+            nonlocal skipped
+            if delivery.chat_id is None:
+                skipped += 1
+                return
+            batch.append(models.BroadcastDelivery(
+                job=job,
+                chat_id=delivery.chat_id,
+                object_id=delivery.key,
+                text="" if delivery.text == text else delivery.text,
+            ))
+            if len(batch) >= self.batch_size:
+                await save()
+
+        if hasattr(deliveries, "__aiter__"):
+            async for delivery in deliveries:
+                await add(delivery)
+        else:
+            for delivery in deliveries:
+                await add(delivery)
+        if batch:
+            await save()
+        if skipped:
+            job.skipped = skipped
+            await models.BroadcastJob.objects.filter(pk=job.pk).aupdate(skipped=skipped)
+        return job
+
+    async def run_job(
+        self,
+        bot: Bot,
+        job: models.BroadcastJob,
+        on_progress: Optional[Callable[[Progress], Awaitable[None]]] = None,
+        progress_interval: float = BROADCAST_PROGRESS_INTERVAL,
+    ) -> models.BroadcastJob:
+        """
+        Send pending deliveries of a job and mark it done
+
+        :param bot: bot instance
+        :param job: job to send
+        :param on_progress: coroutine function called with the counters every progress_interval seconds
+            while they change
+        :param progress_interval: time between progress reports in seconds
+        :return: the job annotated with sent_count and failed_count
+        """
+        await models.BroadcastJob.objects.filter(pk=job.pk, status=models.BroadcastJob.Status.PENDING).aupdate(
+            status=models.BroadcastJob.Status.RUNNING
+        )
+        reply_markup = InlineKeyboardMarkup.parse_obj(job.reply_markup) if job.reply_markup else None
+        broadcast = Broadcast(bot, message_type=job.message_type or None)
+
+        counts = models.BroadcastDelivery.objects.filter(job=job).values_list("status").annotate(count=Count("id"))
+        counts = {status: count async for status, count in counts.order_by()}
+        progress = Progress(
+            total=sum(counts.values()), sent=counts.get(Status.SENT, 0), failed=counts.get(Status.FAILED, 0)
+        )
+
+        results: List[models.BroadcastDelivery] = []
+        unreachable: List[int] = []
+
+        async def save_results():
+            rows, chat_ids = results[:], unreachable[:]
+            results.clear()
+            unreachable.clear()
+            if rows:
+                await models.BroadcastDelivery.objects.abulk_update(
+                    rows, fields=["status", "message_id", "error", "updated_at"]
+                )
+            if chat_ids:
+                # Left out of the following broadcasts until they write to the bot again
+                await models.User.objects.filter(tg_id__in=chat_ids).aupdate(is_reachable=False)
+
+        async def save_result(delivery: Delivery):
+            if delivery.ok:
+                progress.sent += 1
+            else:
+                progress.failed += 1
+                if delivery.unreachable:
+                    unreachable.append(delivery.chat_id)
+            results.append(models.BroadcastDelivery(
+                pk=delivery.key,
+                status=Status.SENT if delivery.ok else Status.FAILED,
+                message_id=delivery.message_id,
+                error="" if delivery.ok else str(delivery.error),
+                updated_at=timezone.now(),
+            ))
+            # Outcomes are written once per claim, a crash before that fails them like the rest of the claim
+            if len(results) >= self.claim_size:
+                await save_results()
+
+        async def deliveries():
+            pending = models.BroadcastDelivery.objects.filter(job=job, status=Status.PENDING).order_by("id")
+            while job.pk not in self._canceled:
+                # Claimed as the workers get to them, a crash leaves at most claim_size deliveries unsent
+                rows = [row async for row in pending.values_list("id", "chat_id", "text")[:self.claim_size]]
+                if not rows:
+                    break
+                await models.BroadcastDelivery.objects.filter(
+                    pk__in=[row[0] for row in rows], status=Status.PENDING
+                ).aupdate(status=Status.SENDING, attempts=F("attempts") + 1)
+                for pk, chat_id, text in rows:
+                    if job.pk in self._canceled:
+                        return
+                    yield Delivery(chat_id=chat_id, text=text or job.text, reply_markup=reply_markup, key=pk)
+
+        async def report_progress():
+            reported = None
+            while True:
+                await asyncio.sleep(progress_interval)
+                if (progress.sent, progress.failed) != reported:
+                    reported = progress.sent, progress.failed
+                    await report(progress)
+
+        async def report(progress: Progress):
+            try:
+                await on_progress(progress)
+            except Exception:
+                logger.exception("Failed to report progress of broadcast job %s", job.pk)
+
+        self._running.add(job.pk)
+        reporter = asyncio.create_task(report_progress()) if on_progress is not None else None
+        try:
+            await broadcast.send(deliveries(), on_result=save_result, name=f"broadcast job {job.pk}")
+            await save_results()
+        finally:
+            self._running.discard(job.pk)
+            canceled = job.pk in self._canceled
+            self._canceled.discard(job.pk)
+            if reporter is not None:
+                reporter.cancel()
+                with suppress(asyncio.CancelledError):
+                    await reporter
+
+        if canceled:
+            # Claimed deliveries the workers did not get to are left in sending
+            await models.BroadcastDelivery.objects.filter(
+                job=job, status__in=[Status.PENDING, Status.SENDING]
+            ).aupdate(status=Status.FAILED, error="Рассылка отменена")
+            await models.BroadcastJob.objects.filter(pk=job.pk).aupdate(
+                status=models.BroadcastJob.Status.CANCELED, finished_at=timezone.now()
+            )
+        else:
+            done = await models.BroadcastJob.objects.filter(
+                pk=job.pk, status=models.BroadcastJob.Status.RUNNING
+            ).aupdate(status=models.BroadcastJob.Status.DONE, finished_at=timezone.now())
+            if not done:
+                # Canceled after the last delivery was claimed, the status set by the cancel is kept
+                await models.BroadcastJob.objects.filter(pk=job.pk).aupdate(finished_at=timezone.now())
+        job = await models.BroadcastJob.objects.annotate(
+            sent_count=Count("deliveries", filter=Q(deliveries__status=Status.SENT)),
+            failed_count=Count("deliveries", filter=Q(deliveries__status=Status.FAILED)),
+        ).aget(pk=job.pk)
+        logger.info(
+            "Broadcast job %s: %d sent, %d failed, %d unreachable recipients skipped",
+            job.pk, job.sent_count, job.failed_count, job.skipped
+        )
+        return job
+
+    async def cancel(self, job_id: int) -> None:
+        """
+        Stop a running job, its unsent deliveries are marked as failed
+        """
+        if job_id in self._running:
+            self._canceled.add(job_id)
+        await models.BroadcastJob.objects.filter(
+            pk=job_id, status__in=[models.BroadcastJob.Status.PENDING, models.BroadcastJob.Status.RUNNING]
+        ).aupdate(status=models.BroadcastJob.Status.CANCELED)
+
+    def spawn(self, coro: Coroutine) -> asyncio.Task:
+        """
+        Run a coroutine sending a job in the background, keeping a reference to its task
+        """
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Broadcast task failed", exc_info=task.exception())
+
+    async def resume(self, bot: Bot) -> None:
+        """
+        Continue jobs interrupted by a restart in background tasks.
+        Deliveries caught in the middle of sending are not sent again
+        """
+        from .utils import Notification
+
+        unfinished = models.BroadcastJob.objects.filter(
+            status__in=[models.BroadcastJob.Status.PENDING, models.BroadcastJob.Status.RUNNING]
+        )
+        await models.BroadcastDelivery.objects.filter(job__in=unfinished, status=Status.SENDING).aupdate(
+            status=Status.FAILED, error="Прервано перезапуском бота"
+        )
+        async for job in unfinished:
+            logger.info("Resuming broadcast job %s", job.pk)
+            self.spawn(Notification.run_job(bot=bot, job=job))
+
+
+outbox = Outbox(batch_size=OUTBOX_BATCH_SIZE, claim_size=OUTBOX_CLAIM_SIZE)
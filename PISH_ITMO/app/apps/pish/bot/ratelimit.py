@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterable, Awaitable, Callable, Hashable, Iterable, Optional, TypeVar, Union
+
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+
+from .cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class TokenBucket:
+    """
+    Asyncio token bucket.
+
+    Waiters reserve their tokens in order of arrival, so concurrent callers
+    are spread evenly over time instead of waking up together.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        """
+        :param rate: tokens restored per second
+        :param capacity: maximum burst, defaults to the rate
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+
+    def pause(self, seconds: float) -> None:
+        """
+        Hold every acquire for the given number of seconds, e.g. after RetryAfter
+        """
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now >= self._paused_until:
+                break
+            await asyncio.sleep(self._paused_until - now)
+
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+        self._tokens -= 1
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+
+class RateLimiter:
+    """
+    Global bucket plus a bucket per chat, matching the limits of the Bot API
+    """
+
+    def __init__(
+        self,
+        rate: float = 25,
+        chat_rate: float = 1,
+        chat_burst: Optional[float] = None,
+        maxsize: int = 10000,
+    ) -> None:
+        """
+        :param rate: requests per second for the whole bot
+        :param chat_rate: requests per second for a single chat
+        :param chat_burst: requests a chat may get in a row, defaults to chat_rate
+        :param maxsize: maximum number of tracked chats
+        """
+        self.bucket = TokenBucket(rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        # A bucket idle for this long is full again and may be forgotten
+        self._chats = TTLCache(maxsize=maxsize, ttl=max(60.0, (chat_burst or 1) / chat_rate))
+
+    def _chat_bucket(self, chat_id: Hashable) -> TokenBucket:
+        bucket = self._chats.get(chat_id, None)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+        self._chats.set(chat_id, bucket)
+        return bucket
+
+    async def acquire(self, chat_id: Optional[Hashable] = None) -> None:
+        # The chat is waited for first, so a busy chat does not hold global tokens
+        if chat_id is not None:
+            await self._chat_bucket(chat_id).acquire()
+        await self.bucket.acquire()
+
+    def pause(self, seconds: float, chat_id: Optional[Hashable] = None) -> None:
+        if chat_id is None:
+            self.bucket.pause(seconds)
+        else:
+            self._chat_bucket(chat_id).pause(seconds)
+
+
+class Throughput:
+    """
+    Counters of a worker pool run
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.done = 0
+        self.failed = 0
+        self.retried = 0
+        self.started_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def rate(self) -> float:
+        return (self.done + self.failed) / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.name}: {self.done} done, {self.failed} failed, {self.retried} retried "
+            f"in {self.elapsed:.1f}s ({self.rate:.1f}/s)"
+        )
+
+
+async def call_limited(
+    limiter: Optional[RateLimiter],
+    call: Callable[[], Awaitable[R]],
+    chat_id: Optional[Hashable] = None,
+    max_retries: int = 3,
+    stats: Optional[Throughput] = None,
+) -> R:
+    """
+    Make a request under the limiter, TelegramRetryAfter pauses the limiter
+    and the request is repeated up to max_retries times
+
+    :param limiter: rate limiter, None makes the request right away
+    :param call: coroutine function making the request
+    :param chat_id: chat of the request for the per-chat limit
+    :param max_retries: RetryAfter retries
+    :param stats: counters to record retries in
+    :return: result of the request
+    """
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            await limiter.acquire(chat_id)
+        try:
+            return await call()
+        except TelegramRetryAfter as e:
+            if limiter is None or attempt == max_retries:
+                raise
+            logger.warning("Flood control exceeded, retry in %s seconds", e.retry_after)
+            limiter.pause(e.retry_after)
+            if stats is not None:
+                stats.retried += 1
+    raise AssertionError("unreachable")
+
+
+async def run_pool(
+    items: Union[Iterable[T], AsyncIterable[T]],
+    call: Callable[[T], Awaitable[Any]],
+    limiter: Optional[RateLimiter],
+    chat_id: Callable[[T], Optional[Hashable]] = lambda item: None,
+    workers: int = 8,
+    max_retries: int = 3,
+    name: str = "pool",
+) -> Throughput:
+    """
+    Run call for every item with a bounded number of workers under the limiter.
+
+    TelegramRetryAfter pauses the whole limiter and the item is retried,
+    any other exception counts the item as failed.
+
+    :param items: items to process, the queue is filled as workers take them
+    :param call: coroutine function processing an item
+    :param limiter: rate limiter shared by the workers, None if call limits itself
+    :param chat_id: chat of an item for the per-chat limit
+    :param workers: number of concurrent requests
+    :param max_retries: RetryAfter retries per item
+    :param name: name used in the report
+    :return: counters of the run
+    """
+    stats = Throughput(name)
+    queue: "asyncio.Queue[T]" = asyncio.Queue(maxsize=workers * 2)
+
+    async def worker() -> None:
+        while True:
+            item = await queue.get()
+            try:
+                await call_limited(
+                    limiter, lambda: call(item), chat_id=chat_id(item), max_retries=max_retries, stats=stats
+                )
+                stats.done += 1
+            except TelegramAPIError as e:
+                stats.failed += 1
+                logger.warning("%s: failed to process %r: %s", name, item, e)
+            except Exception:
+                stats.failed += 1
+                logger.exception("%s: failed to process %r", name, item)
+            finally:
+                queue.task_done()
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    try:
+        if hasattr(items, "__aiter__"):
+            async for item in items:
+                await queue.put(item)
+        else:
+            for item in items:
+                await queue.put(item)
+        await queue.join()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    stats.finished_at = time.monotonic()
+    logger.info("%s", stats)
+    return stats
@@ -0,0 +1,163 @@
+from typing import Dict, Iterable, List, Optional, Union
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup, Message, ReplyKeyboardMarkup
+
+from app.config.bot import MENU_REGISTRY_SIZE
+
+from .buffers import message_buffer
+from .cache import MISSING, TTLCache
+from .. import models
+
+MENU_TYPES = frozenset({models.MessageToDelete.Type.IMENU, models.MessageToDelete.Type.RMENU})
+
+
+class MenuRegistry:
+    """
+    Ids of the menu messages currently shown in each chat.
+
+    A chat is read from the database on first use, after that the registry is
+    authoritative and its changes reach the database through the message buffer.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 24 * 60 * 60) -> None:
+        """
+        :param maxsize: maximum number of chats kept in memory
+        :param ttl: time in seconds after which a chat is read from the database again
+        """
+        self._chats = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, chat_id: int) -> Dict[str, List[int]]:
+        menus = self._chats.get(chat_id)
+        if menus is MISSING:
+            # The database is up to date once pending inserts and deletes are saved
+            await message_buffer.flush()
+            menus = {}
+            messages = models.MessageToDelete.objects.filter(chat_id=chat_id, type__in=MENU_TYPES)
+            async for message_id, message_type in messages.values_list("id", "type"):
+                menus.setdefault(message_type, []).append(message_id)
+            self._chats.set(chat_id, menus)
+        return menus
+
+    async def pop(self, chat_id: int, message_types: Iterable[str]) -> List[int]:
+        """
+        Forget the menus of the given types and schedule deletion of their rows
+
+        :return: ids of the menu messages
+        """
+        menus = await self.get(chat_id)
+        message_ids = []
+        for message_type in message_types:
+            message_ids += menus.pop(message_type, [])
+        if message_ids:
+            message_buffer.delete(message_ids)
+        return message_ids
+
+    def discard(self, chat_id: int, message_ids: Iterable[int]) -> None:
+        """
+        Forget menus deleted by other means, their rows are deleted by the caller
+        """
+        menus = self._chats.get(chat_id, None)
+        if menus:
+            message_ids = set(message_ids)
+            for message_type, menu_ids in menus.items():
+                menus[message_type] = [message_id for message_id in menu_ids if message_id not in message_ids]
+
+    def add(self, chat_id: int, message_id: int, message_type: str) -> None:
+        menus = self._chats.get(chat_id)
+        # A chat not in memory is read from the database, where the buffered row ends up
+        if menus is not MISSING:
+            menus.setdefault(message_type, []).append(message_id)
+
+
+class MenuRenderer:
+    """
+    Shows a menu by editing the current menu message of the chat when it is
+    the last message there, and by sending a new one otherwise.
+
+    A fingerprint of the last rendered text and markup is kept per message,
+    so rendering the same menu again makes no request.
+    """
+
+    def __init__(self, registry: MenuRegistry, maxsize: int = 10000, ttl: float = 24 * 60 * 60) -> None:
+        """
+        :param registry: registry of the menu messages
+        :param maxsize: maximum number of chats kept in memory
+        :param ttl: lifetime of the chat render state in seconds
+        """
+        self.registry = registry
+        # chat_id -> [id of the last message known in the chat, {message_id: fingerprint}]
+        self._chats = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    @staticmethod
+    def fingerprint(text: str, reply_markup: Optional[Union[InlineKeyboardMarkup, ReplyKeyboardMarkup]]) -> int:
+        return hash((text, reply_markup.json(exclude_none=True) if reply_markup else None))
+
+    def forget(self, chat_id: int, message_id: int) -> None:
+        """
+        Drop the fingerprint of a message edited by other means, e.g. by a callback handler
+        """
+        chat = self._chats.get(chat_id, None)
+        if chat is not None:
+            chat[1].pop(message_id, None)
+
+    async def render(
+        self,
+        bot: Bot,
+        trigger: Message,
+        message_type: str,
+        text: str,
+        reply_markup: Union[InlineKeyboardMarkup, ReplyKeyboardMarkup],
+    ) -> int:
+        """
+        Show a menu in response to a user message, which the caller deletes
+
+        :param bot: bot instance
+        :param trigger: user message that asked for the menu
+        :param message_type: "imenu" or "rmenu"
+        :param text: menu text
+        :param reply_markup: menu keyboard, only inline menus can be edited
+        :return: id of the menu message
+        """
+        from .utils import Utils
+
+        chat_id = trigger.chat.id
+        chat = self._chats.get(chat_id, None)
+        if chat is None:
+            chat = [None, {}]
+        self._chats.set(chat_id, chat)
+        last_message_id, fingerprints = chat
+        chat[0] = trigger.message_id
+
+        fingerprint = self.fingerprint(text, reply_markup)
+        message_ids = (await self.registry.get(chat_id)).get(message_type, [])
+        # Message ids of a private chat are sequential, so nothing was shown after the menu if
+        # the last message of the previous render (the menu or its deleted trigger) is just before this one
+        if message_ids and last_message_id is not None and last_message_id == trigger.message_id - 1:
+            message_id = message_ids[-1]
+            if fingerprints.get(message_id) == fingerprint:
+                return message_id
+            if isinstance(reply_markup, InlineKeyboardMarkup) or reply_markup is None:
+                try:
+                    await bot.edit_message_text(
+                        text=text, chat_id=chat_id, message_id=message_id, reply_markup=reply_markup
+                    )
+                    fingerprints[message_id] = fingerprint
+                    return message_id
+                except TelegramBadRequest as e:
+                    if "message is not modified" in e.message:
+                        fingerprints[message_id] = fingerprint
+                        return message_id
+
+        await Utils.delete_message_by_type(chat_id=chat_id, message_types=[message_type], bot=bot)
+        fingerprints.clear()
+        bot_msg = await bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+        await Utils.add_message_to_delete(message_id=bot_msg.message_id, chat_id=chat_id, message_type=message_type)
+        fingerprints[bot_msg.message_id] = fingerprint
+        chat[0] = max(trigger.message_id, bot_msg.message_id)
+        return bot_msg.message_id
+
+
+menu_registry = MenuRegistry(maxsize=MENU_REGISTRY_SIZE)
+menu_renderer = MenuRenderer(menu_registry, maxsize=MENU_REGISTRY_SIZE)
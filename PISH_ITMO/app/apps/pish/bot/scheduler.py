@@ -0,0 +1,142 @@
+import asyncio
+import datetime
+import heapq
+import logging
+import time
+from contextlib import suppress
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from django.utils import timezone
+
+from app.config.bot import DELETE_CHAT_BURST, DELETE_CHAT_RATE, DELETE_RATE, DELETE_WORKERS
+
+from .buffers import message_buffer
+from .ratelimit import RateLimiter, run_pool
+from .registry import menu_registry
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+
+class DeletionScheduler:
+    """
+    Deletes tracked messages when their expires_at comes.
+
+    Due times are kept in a heap, rebuilt from the database at startup and
+    filled by Utils.add_message_to_delete while the bot runs.
+    """
+
+    def __init__(self, batch_size: int = 1000) -> None:
+        """
+        :param batch_size: maximum number of messages deleted in one go
+        """
+        self.batch_size = batch_size
+        self.policies: Dict[str, datetime.timedelta] = {}
+        self.limiter = RateLimiter(rate=DELETE_RATE, chat_rate=DELETE_CHAT_RATE, chat_burst=DELETE_CHAT_BURST)
+        # (due timestamp, chat_id, message_id), entries missing from _scheduled were discarded
+        self._heap: List[Tuple[float, int, int]] = []
+        self._scheduled: Dict[Tuple[int, int], float] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._scheduled)
+
+    async def start(self, bot: Bot) -> None:
+        self.policies = {policy.type: policy.lifetime async for policy in models.DeletionPolicy.objects.all()}
+
+        messages = models.MessageToDelete.objects.filter(expires_at__isnull=False).order_by("id")
+        last_id = None
+        while True:
+            chunk = messages.filter(id__gt=last_id) if last_id is not None else messages
+            rows = [row async for row in chunk.values_list("id", "chat_id", "expires_at")[:self.batch_size]]
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            for message_id, chat_id, expires_at in rows:
+                due = expires_at.timestamp()
+                self._scheduled[(chat_id, message_id)] = due
+                self._heap.append((due, chat_id, message_id))
+        heapq.heapify(self._heap)
+        logger.info("Deletion scheduler started with %d messages", len(self._heap))
+
+        self._task = asyncio.create_task(self._run(bot))
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    def expires_at(self, message_type: str) -> Optional[datetime.datetime]:
+        """
+        Expiry time of a message of the given type sent now, None if it is kept
+        """
+        lifetime = self.policies.get(message_type)
+        if lifetime is None:
+            return None
+        return timezone.now() + lifetime
+
+    def schedule(self, chat_id: int, message_id: int, expires_at: datetime.datetime) -> None:
+        due = expires_at.timestamp()
+        self._scheduled[(chat_id, message_id)] = due
+        heapq.heappush(self._heap, (due, chat_id, message_id))
+        if self._heap[0][0] == due:
+            self._wakeup.set()
+
+    def discard(self, chat_id: int, message_ids: List[int]) -> None:
+        """
+        Forget messages deleted by other means, their heap entries are skipped when due
+        """
+        for message_id in message_ids:
+            self._scheduled.pop((chat_id, message_id), None)
+
+    def _pop_due(self) -> List[Tuple[int, int]]:
+        now = time.time()
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+            timestamp, chat_id, message_id = heapq.heappop(self._heap)
+            if self._scheduled.get((chat_id, message_id)) == timestamp:
+                del self._scheduled[(chat_id, message_id)]
+                due.append((chat_id, message_id))
+        return due
+
+    async def _run(self, bot: Bot) -> None:
+        while True:
+            due = self._pop_due()
+            if due:
+                try:
+                    await self._delete(bot, due)
+                except Exception:
+                    logger.exception("Failed to delete %d expired messages", len(due))
+                continue
+
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            self._wakeup.clear()
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+
+    async def _delete(self, bot: Bot, due: List[Tuple[int, int]]) -> None:
+        from .utils import DELETE_BATCH_SIZE, Utils
+
+        # Rows of the due messages may still be in the buffer
+        await message_buffer.flush()
+
+        batches = []
+        for chat_id, message_id in sorted(due):
+            if not batches or batches[-1][0] != chat_id or len(batches[-1][1]) == DELETE_BATCH_SIZE:
+                batches.append((chat_id, []))
+            batches[-1][1].append(message_id)
+
+        async def delete(batch: tuple):
+            await Utils.delete_chat_messages(bot=bot, chat_id=batch[0], message_ids=batch[1], limiter=self.limiter)
+
+        await run_pool(batches, delete, limiter=None, workers=DELETE_WORKERS, name="expired messages")
+        for chat_id, message_ids in batches:
+            menu_registry.discard(chat_id=chat_id, message_ids=message_ids)
+        await models.MessageToDelete.objects.filter(pk__in=[message_id for _, message_id in due]).adelete()
+
+
+deletion_scheduler = DeletionScheduler()
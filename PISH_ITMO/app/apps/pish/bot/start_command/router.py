@@ -2,21 +2,26 @@ from contextlib import suppress
 
 from aiogram import Bot, Router, types
 from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import StateFilter
 from aiogram.filters.command import Command
 from aiogram.fsm.context import FSMContext
 
 from ..menu.keyboards import menu as kb_menu
 from ..menu.router import Menu
+from ..menu.text import session_expired as text_session_expired
 from ..registration.keyboards import start_reg as kb_start_reg
 from ..registration.router import Registration
 from ..registration.text import new_user as text_new_user
-from ..utils import User, Utils, SpamFilter
+from ..registry import menu_renderer
+from ..utils import User, Utils
 from .text import start as text_start
 
 router = Router()
+# Included after all other routers, answers callbacks of users whose state was swept as idle
+fallback_router = Router()
 
 
-@router.message(Command(commands=["start"]), SpamFilter())
+@router.message(Command(commands=["start"]))
 async def start(message: types.Message, state: FSMContext, bot: Bot):
     user_id = await User.get_user_id(tg_id=message.from_user.id)
 
@@ -35,8 +40,13 @@ async def start(message: types.Message, state: FSMContext, bot: Bot):
         await state.update_data({"reg_message": bot_msg.message_id})
 
     else:
+        await User.set_reachable(tg_id=message.from_user.id)
         await state.set_state(Menu.main)
-        await Utils.delete_message_by_type(chat_id=message.chat.id, message_types=["rmenu", "imenu"], bot=bot)
-        bot_msg = await message.answer(text=text_start, reply_markup=kb_menu)
+        await Utils.delete_message_by_type(chat_id=message.chat.id, message_types=["imenu"], bot=bot)
+        await menu_renderer.render(bot, message, "rmenu", text=text_start, reply_markup=kb_menu)
         await message.delete()
-        await Utils.add_message_to_delete(message_id=bot_msg.message_id, chat_id=bot_msg.chat.id, message_type="rmenu")
+
+
+@fallback_router.callback_query(StateFilter(None))
+async def expired_callback(callback: types.CallbackQuery):
+    await callback.answer(text=text_session_expired, show_alert=True)
@@ -1,9 +1,15 @@
+import asyncio
+import copy
+import datetime
+import json
 from abc import ABC, abstractmethod
 from contextlib import asynccontextmanager
-from typing import Any, AsyncGenerator, Dict, Literal, Optional, cast
+from typing import Any, AsyncGenerator, Dict, List, Literal, Optional, Tuple, Type, cast
 
+import msgpack
 from aiogram import Bot
 from aiogram.fsm.state import State
+from aiogram.fsm.storage import redis as redis_storage
 from aiogram.fsm.storage.base import (
     DEFAULT_DESTINY,
     BaseEventIsolation,
@@ -13,8 +19,13 @@ from aiogram.fsm.storage.base import (
 )
 from asgiref.sync import sync_to_async
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection, models
+from django.db.models import Q
+from django.utils import timezone
 
-from app.apps.pish.models import Storage
+from app.apps.pish.models import Storage, StorageRecord
+
+from .cache import MISSING, TTLCache
 
 
 class KeyBuilder(ABC):
@@ -23,7 +34,7 @@ class KeyBuilder(ABC):
     """
 
     @abstractmethod
-    def build(self, key: StorageKey, part: Literal["data", "state", "lock"]) -> str:
+    def build(self, key: StorageKey, part: Literal["data", "state", "lock", "record"]) -> str:
         """
         This method should be implemented in subclasses
 
@@ -61,7 +72,7 @@ class DefaultKeyBuilder(KeyBuilder):
         self.with_bot_id = with_bot_id
         self.with_destiny = with_destiny
 
-    def build(self, key: StorageKey, part: Literal["data", "state", "lock"]) -> str:
+    def build(self, key: StorageKey, part: Literal["data", "state", "lock", "record"]) -> str:
         parts = [self.prefix]
         if self.with_bot_id:
             parts.append(str(key.bot_id))
@@ -82,14 +93,79 @@ class DefaultKeyBuilder(KeyBuilder):
 class DjangoStorage(BaseStorage):
     def __init__(
         self,
-        key_builder: Optional[KeyBuilder] = None
+        key_builder: Optional[KeyBuilder] = None,
+        single_row: bool = False,
+        codec: Literal["json", "binary"] = "json",
+        layout: Literal["key", "columns"] = "key",
+        touch_interval: datetime.timedelta = datetime.timedelta(hours=1),
     ) -> None:
         """
         :param key_builder: builder that helps to convert contextual key to string
+        :param single_row: keep state and data of a key in one row instead of two
+        :param codec: "json" keeps data as a JSON object in the data column,
+            "binary" keeps it msgpack-encoded in the payload column
+        :param layout: "key" stores rows in Storage under a string key,
+            "columns" stores one row per key in StorageRecord, keyed by
+            (bot_id, chat_id, user_id, destiny)
+        :param touch_interval: reads refresh touched_at of rows older than this,
+            so users who only read are not swept as idle
         """
         if key_builder is None:
             key_builder = DefaultKeyBuilder()
+        if codec not in ("json", "binary"):
+            raise ValueError(f"Unknown FSM storage codec: {codec!r}")
+        if layout not in ("key", "columns"):
+            raise ValueError(f"Unknown FSM storage layout: {layout!r}")
         self.key_builder = key_builder
+        self.single_row = single_row or layout == "columns"
+        self.codec = codec
+        self.layout = layout
+        self.touch_interval = touch_interval
+
+    def _lookup(self, key: StorageKey, part: Literal["data", "state"]) -> Tuple[Type[models.Model], Dict[str, Any]]:
+        """
+        :return: model of the row and the fields identifying it
+        """
+        if self.layout == "columns":
+            return StorageRecord, {
+                "bot_id": key.bot_id,
+                "chat_id": key.chat_id,
+                "user_id": key.user_id,
+                "destiny": key.destiny,
+            }
+        return Storage, {"key": self.key_builder.build(key, "record" if self.single_row else part)}
+
+    @staticmethod
+    @sync_to_async
+    def _upsert(model: Type[models.Model], lookup: Dict[str, Any], **fields: Any) -> None:
+        """
+        Write the given fields of a row with a single
+        INSERT ... ON CONFLICT DO UPDATE statement (PostgreSQL, SQLite)
+
+        :param model: Storage or StorageRecord
+        :param lookup: fields of the unique key of the row
+        :param fields: model fields to set
+        """
+        opts = model._meta
+        qn = connection.ops.quote_name
+        row = model(**lookup, **fields)
+        columns, params = [], []
+        for field in opts.concrete_fields:
+            if field.primary_key and field.name not in lookup:
+                continue
+            columns.append(qn(field.column))
+            params.append(field.get_db_prep_save(field.pre_save(row, add=True), connection=connection))
+        conflict = ", ".join(qn(opts.get_field(name).column) for name in lookup)
+        updates = ", ".join(
+            f"{qn(opts.get_field(name).column)} = EXCLUDED.{qn(opts.get_field(name).column)}"
+            for name in [*fields, "touched_at"]
+        )
+        sql = (
+            f"INSERT INTO {qn(opts.db_table)} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+            f"ON CONFLICT ({conflict}) DO UPDATE SET {updates}"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
 
     async def set_state(
         self,
@@ -97,31 +173,42 @@ class DjangoStorage(BaseStorage):
         key: StorageKey,
         state: StateType = None,
     ) -> None:
-        django_key = self.key_builder.build(key, "state")
+        model, lookup = self._lookup(key, "state")
         if state is None:
-            await Storage.objects.filter(key=django_key).adelete()
+            if self.single_row:
+                await model.objects.filter(**lookup).aupdate(state="", touched_at=timezone.now())
+            else:
+                await model.objects.filter(**lookup).adelete()
         else:
-            try:
-                old_state = await Storage.objects.aget(key=django_key)
-                setattr(old_state, "state", cast(str, state.state if isinstance(state, State) else state))
-                await sync_to_async(old_state.save)(update_fields=["state"])
-            except Storage.DoesNotExist:
-                await Storage.objects.acreate(
-                    key=django_key,
-                    state=cast(str, state.state if isinstance(state, State) else state)
-                )
+            await self._upsert(model, lookup, state=cast(str, state.state if isinstance(state, State) else state))
+
+    async def _touch(self, key: StorageKey) -> None:
+        """
+        Refresh touched_at of all rows of a key, both rows expire together in the two-row layout
+        """
+        if self.single_row:
+            model, lookup = self._lookup(key, "state")
+            rows = model.objects.filter(**lookup)
+        else:
+            rows = Storage.objects.filter(
+                key__in=[self.key_builder.build(key, "state"), self.key_builder.build(key, "data")]
+            )
+        await rows.aupdate(touched_at=timezone.now())
 
     async def get_state(
         self,
         bot: Bot,
         key: StorageKey,
     ) -> Optional[str]:
-        django_key = self.key_builder.build(key, "state")
+        model, lookup = self._lookup(key, "state")
         try:
-            value = (await Storage.objects.values("state").aget(key=django_key))["state"]
+            row = await model.objects.values("state", "touched_at").aget(**lookup)
         except ObjectDoesNotExist:
-            value = None
-        return cast(Optional[str], value)
+            return None
+        # The state is read for every update, so this keeps the rows of active users
+        if row["touched_at"] < timezone.now() - self.touch_interval:
+            await self._touch(key)
+        return cast(Optional[str], row["state"] or None)
 
     async def set_data(
         self,
@@ -129,31 +216,428 @@ class DjangoStorage(BaseStorage):
         key: StorageKey,
         data: Dict[str, Any],
     ) -> None:
-        django_key = self.key_builder.build(key, "data")
+        model, lookup = self._lookup(key, "data")
         if not data:
-            await Storage.objects.filter(key=django_key).adelete()
+            if self.single_row:
+                await model.objects.filter(**lookup).aupdate(data=None, payload=None, touched_at=timezone.now())
+            else:
+                await model.objects.filter(**lookup).adelete()
             return
-        try:
-            old_data = await Storage.objects.aget(key=django_key)
-            setattr(old_data, "data", bot.session.json_dumps(data))
-            await sync_to_async(old_data.save)(update_fields=["data"])
-        except Storage.DoesNotExist:
-            await Storage.objects.acreate(
-                key=django_key,
-                data=bot.session.json_dumps(data)
-            )
+        if self.codec == "binary":
+            await self._upsert(model, lookup, data=None, payload=msgpack.packb(data, use_bin_type=True))
+        else:
+            await self._upsert(model, lookup, data=data, payload=None)
 
     async def get_data(
         self,
         bot: Bot,
         key: StorageKey,
     ) -> Dict[str, Any]:
-        django_key = self.key_builder.build(key, "data")
+        model, lookup = self._lookup(key, "data")
         try:
-            value = (await Storage.objects.values("data").aget(key=django_key))["data"]
+            row = await model.objects.values("data", "payload", "touched_at").aget(**lookup)
         except ObjectDoesNotExist:
             return {}
-        return cast(Dict[str, Any], bot.session.json_loads(value))
+        if row["touched_at"] < timezone.now() - self.touch_interval:
+            await self._touch(key)
+        if row["payload"] is not None:
+            return cast(Dict[str, Any], msgpack.unpackb(row["payload"], raw=False, strict_map_key=False))
+        value = row["data"]
+        if value is None:
+            return {}
+        if isinstance(value, str):
+            # Rows written before data was stored as a JSON object
+            value = bot.session.json_loads(value)
+        return cast(Dict[str, Any], value)
+
+    async def set_record(
+        self,
+        bot: Bot,
+        key: StorageKey,
+        state: StateType,
+        data: Dict[str, Any],
+    ) -> None:
+        """
+        Write state and data together, with one statement in the single-row layouts
+
+        :param bot: instance of the current bot
+        :param key: storage key
+        :param state: new state
+        :param data: new data
+        """
+        if not self.single_row:
+            await self.set_state(bot=bot, key=key, state=state)
+            await self.set_data(bot=bot, key=key, data=data)
+            return
+        model, lookup = self._lookup(key, "state")
+        fields: Dict[str, Any] = {"state": cast(str, state.state if isinstance(state, State) else state) or ""}
+        if not data:
+            fields.update(data=None, payload=None)
+        elif self.codec == "binary":
+            fields.update(data=None, payload=msgpack.packb(data, use_bin_type=True))
+        else:
+            fields.update(data=data, payload=None)
+        await self._upsert(model, lookup, **fields)
+
+    @staticmethod
+    @sync_to_async
+    def _merge(model: Type[models.Model], lookup: Dict[str, Any], data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Shallow-merge data into the JSON object of a row (like dict.update)
+        with a single INSERT ... ON CONFLICT DO UPDATE ... RETURNING statement:
+        jsonb || on PostgreSQL, json_set on SQLite
+
+        :param model: Storage or StorageRecord
+        :param lookup: fields of the unique key of the row
+        :param data: partial data
+        :return: merged data or None when the row can't be merged in place
+        """
+        opts = model._meta
+        qn = connection.ops.quote_name
+        table = qn(opts.db_table)
+        data_field = opts.get_field("data")
+        data_column = f"{table}.{qn(data_field.column)}"
+        row = model(**lookup, data=data)
+        columns, params = [], []
+        for field in opts.concrete_fields:
+            if field.primary_key and field.name not in lookup:
+                continue
+            columns.append(qn(field.column))
+            params.append(field.get_db_prep_save(field.pre_save(row, add=True), connection=connection))
+
+        if connection.vendor == "postgresql":
+            merged = f"COALESCE({data_column}, '{{}}'::jsonb) || EXCLUDED.{qn(data_field.column)}"
+            mergeable = f"jsonb_typeof({data_column}) = 'object'"
+            merge_params = []
+        elif connection.vendor == "sqlite":
+            if any('"' in name or "\\" in name for name in data):
+                return None
+            merged = f"json_set(COALESCE({data_column}, '{{}}'), {', '.join(['%s, json(%s)'] * len(data))})"
+            mergeable = f"json_type({data_column}) = 'object'"
+            merge_params = []
+            for name, value in data.items():
+                merge_params.extend([f'$."{name}"', json.dumps(value)])
+        else:
+            return None
+
+        conflict = ", ".join(qn(opts.get_field(name).column) for name in lookup)
+        touched_at = qn(opts.get_field("touched_at").column)
+        sql = (
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+            f"ON CONFLICT ({conflict}) DO UPDATE SET {qn(data_field.column)} = {merged}, "
+            f"{touched_at} = EXCLUDED.{touched_at} "
+            # Rows holding a binary payload or a legacy string are merged in Python
+            f"WHERE {table}.{qn(opts.get_field('payload').column)} IS NULL "
+            f"AND ({data_column} IS NULL OR {mergeable}) "
+            f"RETURNING {qn(data_field.column)}"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params + merge_params)
+            result = cursor.fetchone()
+        if result is None:
+            return None
+        return cast(Dict[str, Any], data_field.from_db_value(result[0], None, connection))
+
+    async def update_data(
+        self,
+        bot: Bot,
+        key: StorageKey,
+        data: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        if not data:
+            return await self.get_data(bot=bot, key=key)
+        if self.codec == "json":
+            model, lookup = self._lookup(key, "data")
+            merged = await self._merge(model, lookup, data)
+            if merged is not None:
+                return merged
+        return await super().update_data(bot=bot, key=key, data=data)
+
+    @staticmethod
+    async def delete_stale(idle_ttl: datetime.timedelta, batch_size: int = 1000) -> int:
+        """
+        Delete rows of both layouts not written for longer than idle_ttl and
+        rows left empty by clearing both parts, in batches of batch_size rows.
+        Users of deleted rows have no state, so they are asked to send /start again
+
+        :param idle_ttl: how long a row may stay untouched
+        :param batch_size: number of rows deleted by one statement
+        :return: number of deleted rows
+        """
+        deleted = 0
+        for model in (Storage, StorageRecord):
+            stale = model.objects.filter(
+                Q(touched_at__lt=timezone.now() - idle_ttl)
+                | Q(state="", data__isnull=True, payload__isnull=True)
+            )
+            while True:
+                pks = [pk async for pk in stale.values_list("pk", flat=True)[:batch_size]]
+                if not pks:
+                    break
+                # Re-check the condition, a row may have been written since it was selected
+                count, _ = await stale.filter(pk__in=pks).adelete()
+                deleted += count
+                if len(pks) < batch_size:
+                    break
+        return deleted
 
     async def close(self) -> None:
         pass
+
+
+class RedisStorage(redis_storage.RedisStorage):
+    """
+    aiogram's Redis FSM storage writing state and data of a key in one round trip.
+
+    Accepts any client with the ``redis.asyncio`` interface, so tests can
+    pass an in-process fake such as ``fakeredis.aioredis.FakeRedis()``.
+    """
+
+    async def set_record(
+        self,
+        bot: Bot,
+        key: StorageKey,
+        state: StateType,
+        data: Dict[str, Any],
+    ) -> None:
+        """
+        Write state and data in one pipelined round trip
+
+        :param bot: instance of the current bot
+        :param key: storage key
+        :param state: new state
+        :param data: new data
+        """
+        state_key = self.key_builder.build(key, "state")
+        data_key = self.key_builder.build(key, "data")
+        async with self.redis.pipeline(transaction=False) as pipe:
+            if state is None:
+                pipe.delete(state_key)
+            else:
+                pipe.set(state_key, cast(str, state.state if isinstance(state, State) else state), ex=self.state_ttl)
+            if not data:
+                pipe.delete(data_key)
+            else:
+                pipe.set(data_key, bot.session.json_dumps(data), ex=self.data_ttl)
+            await pipe.execute()
+
+
+class DjangoEventIsolation(BaseEventIsolation):
+    """
+    Serializes handling of updates that share a StorageKey.
+
+    Inside one process updates wait on a per-key asyncio lock. With
+    ``advisory=True`` the key is additionally locked with a PostgreSQL
+    session advisory lock, so several bot processes sharing the database
+    do not interleave either.
+    """
+
+    def __init__(
+        self,
+        key_builder: Optional[KeyBuilder] = None,
+        advisory: bool = False,
+        poll_interval: float = 0.05,
+    ) -> None:
+        """
+        :param key_builder: builder that helps to convert contextual key to string
+        :param advisory: also take a PostgreSQL advisory lock for the key
+        :param poll_interval: delay between advisory lock attempts in seconds
+        """
+        if key_builder is None:
+            key_builder = DefaultKeyBuilder()
+        if advisory and connection.vendor != "postgresql":
+            raise ValueError("Advisory locks require PostgreSQL database")
+        self.key_builder = key_builder
+        self.advisory = advisory
+        self.poll_interval = poll_interval
+        # lock and the number of coroutines holding or waiting for it
+        self._locks: Dict[str, List[Any]] = {}
+
+    @staticmethod
+    @sync_to_async
+    def _try_advisory_lock(lock_key: str) -> bool:
+        # pg_try_advisory_lock does not block the thread shared by the async ORM calls
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(hashtext(%s))", [lock_key])
+            return bool(cursor.fetchone()[0])
+
+    @staticmethod
+    @sync_to_async
+    def _advisory_unlock(lock_key: str) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", [lock_key])
+
+    @asynccontextmanager
+    async def lock(
+        self,
+        bot: Bot,
+        key: StorageKey,
+    ) -> AsyncGenerator[None, None]:
+        lock_key = self.key_builder.build(key, "lock")
+        entry = self._locks.setdefault(lock_key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                if not self.advisory:
+                    yield None
+                    return
+                while not await self._try_advisory_lock(lock_key):
+                    await asyncio.sleep(self.poll_interval)
+                try:
+                    yield None
+                finally:
+                    await self._advisory_unlock(lock_key)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[lock_key]
+
+    async def close(self) -> None:
+        self._locks.clear()
+
+
+class CachedStorage(BaseStorage):
+    """
+    Write-through in-process cache in front of another FSM storage.
+
+    Reads are served from a bounded LRU with TTL eviction, writes go
+    to the wrapped storage first and then replace the cached value.
+    The bot process must be the only writer of the wrapped storage,
+    otherwise the TTL bounds how long a stale value can be served.
+    """
+
+    def __init__(
+        self,
+        storage: BaseStorage,
+        maxsize: int = 10000,
+        ttl: float = 300,
+    ) -> None:
+        """
+        :param storage: wrapped storage
+        :param maxsize: maximum number of cached state and data entries
+        :param ttl: lifetime of a cached entry in seconds
+        """
+        self.storage = storage
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        # Bumped on every write, so a read that raced with a write
+        # does not put the value it fetched before the write into the cache
+        self._generation = 0
+
+    @property
+    def hits(self) -> int:
+        return self.cache.hits
+
+    @property
+    def misses(self) -> int:
+        return self.cache.misses
+
+    def _store(self, cache_key: Any, value: Any) -> None:
+        self._generation += 1
+        self.cache.set(cache_key, value)
+
+    def _invalidate(self, cache_key: Any) -> None:
+        self._generation += 1
+        self.cache.pop(cache_key)
+
+    async def set_state(
+        self,
+        bot: Bot,
+        key: StorageKey,
+        state: StateType = None,
+    ) -> None:
+        try:
+            await self.storage.set_state(bot=bot, key=key, state=state)
+        except Exception:
+            self._invalidate((key, "state"))
+            raise
+        self._store((key, "state"), state.state if isinstance(state, State) else state)
+
+    async def get_state(
+        self,
+        bot: Bot,
+        key: StorageKey,
+    ) -> Optional[str]:
+        value = self.cache.get((key, "state"))
+        if value is MISSING:
+            generation = self._generation
+            value = await self.storage.get_state(bot=bot, key=key)
+            if generation == self._generation:
+                self.cache.set((key, "state"), value)
+        return cast(Optional[str], value)
+
+    async def set_data(
+        self,
+        bot: Bot,
+        key: StorageKey,
+        data: Dict[str, Any],
+    ) -> None:
+        try:
+            await self.storage.set_data(bot=bot, key=key, data=data)
+        except Exception:
+            self._invalidate((key, "data"))
+            raise
+        self._store((key, "data"), copy.deepcopy(data))
+
+    async def get_data(
+        self,
+        bot: Bot,
+        key: StorageKey,
+    ) -> Dict[str, Any]:
+        value = self.cache.get((key, "data"))
+        if value is MISSING:
+            generation = self._generation
+            value = await self.storage.get_data(bot=bot, key=key)
+            if generation == self._generation:
+                self.cache.set((key, "data"), copy.deepcopy(value))
+            return value
+        # Handlers mutate nested values of the returned dict in place
+        return copy.deepcopy(cast(Dict[str, Any], value))
+
+    async def set_record(
+        self,
+        bot: Bot,
+        key: StorageKey,
+        state: StateType,
+        data: Dict[str, Any],
+    ) -> None:
+        """
+        Write state and data together, in one operation if the wrapped storage supports it
+
+        :param bot: instance of the current bot
+        :param key: storage key
+        :param state: new state
+        :param data: new data
+        """
+        try:
+            if hasattr(self.storage, "set_record"):
+                await self.storage.set_record(bot=bot, key=key, state=state, data=data)
+            else:
+                await self.storage.set_state(bot=bot, key=key, state=state)
+                await self.storage.set_data(bot=bot, key=key, data=data)
+        except Exception:
+            self._invalidate((key, "state"))
+            self._invalidate((key, "data"))
+            raise
+        self._store((key, "state"), state.state if isinstance(state, State) else state)
+        self._store((key, "data"), copy.deepcopy(data))
+
+    async def update_data(
+        self,
+        bot: Bot,
+        key: StorageKey,
+        data: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        if not data:
+            return await self.get_data(bot=bot, key=key)
+        try:
+            # The wrapped storage may merge the data in place without reading it
+            merged = await self.storage.update_data(bot=bot, key=key, data=data)
+        except Exception:
+            self._invalidate((key, "data"))
+            raise
+        self._store((key, "data"), copy.deepcopy(merged))
+        return merged
+
+    async def close(self) -> None:
+        self.cache.clear()
+        await self.storage.close()
@@ -1,26 +1,34 @@
-import asyncio
 import datetime
-import time
 from contextlib import suppress
-from typing import Union, Dict, Any
+from typing import Awaitable, Callable
 
 import pytz
 from aiogram import Bot
 from aiogram.dispatcher.event.handler import CallbackType
-from aiogram.exceptions import TelegramBadRequest
-from aiogram.filters import BaseFilter
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramRetryAfter
 from aiogram.filters.logic import _OrFilter
-from aiogram.fsm.context import FSMContext
-from aiogram.types import Message, InlineKeyboardButton
+from aiogram.types import InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from asgiref.sync import sync_to_async
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Q, F, Count
+from django.db.models import Q, F, Count, QuerySet
 from django.utils import timezone
 
+from app.config.bot import DELETE_CHAT_BURST, DELETE_CHAT_RATE, DELETE_RATE, DELETE_WORKERS
+
+from .broadcast import Delivery
+from .buffers import message_buffer
 from .menu.manager import text as manager_text
+from .methods import DeleteMessages
+from .outbox import Progress, outbox
+from .ratelimit import RateLimiter, call_limited, run_pool
+from .registry import MENU_TYPES, menu_registry
+from .scheduler import deletion_scheduler
 from .. import models
 
+DELETE_BATCH_SIZE = 100
+PURGE_CHUNK_SIZE = 1000
+
 
 class User:
     @staticmethod
@@ -32,13 +40,18 @@ class User:
 
     @staticmethod
     async def register_user(tg_id: int, username: str):
-        user = await models.User.objects.filter(username=username).aupdate(tg_id=tg_id)
+        user = await models.User.objects.filter(username=username).aupdate(tg_id=tg_id, is_reachable=True)
 
         if user != 0:
             return True
         else:
             return False
 
+    @staticmethod
+    async def set_reachable(tg_id: int):
+        # Users left out of broadcasts after blocking the bot are back once they write to it
+        await models.User.objects.filter(tg_id=tg_id, is_reachable=False).aupdate(is_reachable=True)
+
     @staticmethod
     async def get_user_status(tg_id: int) -> str | None:
         try:
@@ -344,32 +357,116 @@ class ConsultationInterval:
 
 class Utils:
     @staticmethod
-    async def add_message_to_delete(message_id: int, chat_id: int, message_type: str):
-        await models.MessageToDelete.objects.acreate(
-            id=message_id,
-            chat_id=chat_id,
-            type=message_type
-        )
+    async def add_message_to_delete(message_id: int, chat_id: int, message_type: str, immediate: bool = False):
+        """
+        Track a message for deletion. The row is buffered and saved in a batch
+        unless immediate is set or the buffer is disabled.
+        Messages of types with a deletion policy are deleted when it expires
+        """
+        expires_at = deletion_scheduler.expires_at(message_type)
+        if immediate or not message_buffer.max_size:
+            await models.MessageToDelete.objects.acreate(
+                id=message_id,
+                chat_id=chat_id,
+                type=message_type,
+                expires_at=expires_at
+            )
+        else:
+            await message_buffer.add(
+                message_id=message_id, chat_id=chat_id, message_type=message_type, expires_at=expires_at
+            )
+        if expires_at:
+            deletion_scheduler.schedule(chat_id=chat_id, message_id=message_id, expires_at=expires_at)
+        if message_type in MENU_TYPES:
+            menu_registry.add(chat_id=chat_id, message_id=message_id, message_type=message_type)
+
+    @staticmethod
+    async def delete_chat_messages(bot: Bot, chat_id: int, message_ids: list, limiter: RateLimiter = None):
+        """
+        Delete messages of a chat with deleteMessages, 100 ids per request.
+        If a batch fails its messages are deleted one by one
+        """
+        for i in range(0, len(message_ids), DELETE_BATCH_SIZE):
+            batch = message_ids[i:i + DELETE_BATCH_SIZE]
+            try:
+                await call_limited(limiter, lambda: bot(DeleteMessages(chat_id=chat_id, message_ids=batch)), chat_id)
+                continue
+            except TelegramRetryAfter:
+                raise
+            except TelegramAPIError:
+                pass
+            for message_id in batch:
+                with suppress(TelegramBadRequest):
+                    await call_limited(
+                        limiter, lambda: bot.delete_message(message_id=message_id, chat_id=chat_id), chat_id
+                    )
 
     @staticmethod
     async def delete_message_by_type(chat_id: int, message_types: list, bot: Bot):
+        if MENU_TYPES.issuperset(message_types):
+            # Menus are tracked in memory, their rows are deleted later in a batch
+            message_ids = await menu_registry.pop(chat_id=chat_id, message_types=message_types)
+            if message_ids:
+                await Utils.delete_chat_messages(bot=bot, chat_id=chat_id, message_ids=message_ids)
+                deletion_scheduler.discard(chat_id=chat_id, message_ids=message_ids)
+            return
+
         messages = models.MessageToDelete.objects.filter(chat_id=chat_id, type__in=message_types)
-        async for message in messages:
-            with suppress(TelegramBadRequest):
-                await bot.delete_message(message_id=message.id, chat_id=message.chat_id)
-        await messages.adelete()
+        stored_ids = [message_id async for message_id in messages.values_list("id", flat=True)]
+        message_ids = message_buffer.pop(chat_id=chat_id, message_types=message_types) + stored_ids
+        if message_ids:
+            await Utils.delete_chat_messages(bot=bot, chat_id=chat_id, message_ids=message_ids)
+            deletion_scheduler.discard(chat_id=chat_id, message_ids=message_ids)
+        if stored_ids:
+            await models.MessageToDelete.objects.filter(pk__in=stored_ids).adelete()
 
     @staticmethod
     async def delete_messages(bot: Bot, types: list, next_day: bool = False):
+        await message_buffer.flush()
         messages = models.MessageToDelete.objects.filter(type__in=types)
         if next_day:
             date = timezone.now().astimezone(pytz.timezone("Europe/Moscow"))
-            messages = messages.filter(created_at__date=(date - datetime.timedelta(days=1)).date())
-        async for message in messages:
-            with suppress(TelegramBadRequest):
-                await bot.delete_message(message_id=message.id, chat_id=message.chat_id)
-            await asyncio.sleep(1)
-        await messages.adelete()
+            start = timezone.make_aware(datetime.datetime.combine(date.date(), datetime.time.min))
+            messages = messages.filter(created_at__gte=start - datetime.timedelta(days=1), created_at__lt=start)
+
+        limiter = RateLimiter(rate=DELETE_RATE, chat_rate=DELETE_CHAT_RATE, chat_burst=DELETE_CHAT_BURST)
+
+        async def delete(batch: tuple):
+            await Utils.delete_chat_messages(bot=bot, chat_id=batch[0], message_ids=batch[1], limiter=limiter)
+            menu_registry.discard(chat_id=batch[0], message_ids=batch[1])
+
+        # Rows are read in chunks ordered by (type, created_at, id) along the message_type_created_idx index
+        # and exactly the rows of a chunk are deleted, rows added while the purge runs are left for the next one
+        last = None
+        while True:
+            chunk = messages.order_by("type", "created_at", "id")
+            if last:
+                chunk = chunk.filter(
+                    Q(type__gt=last[0])
+                    | Q(type=last[0], created_at__gt=last[1])
+                    | Q(type=last[0], created_at=last[1], id__gt=last[2])
+                )
+            rows = [row async for row in chunk.values_list("type", "created_at", "id", "chat_id")[:PURGE_CHUNK_SIZE]]
+            if not rows:
+                break
+            last = rows[-1]
+
+            # Grouped by chat, so a chat's messages of the chunk go out in as few requests as possible
+            batches = []
+            for chat_id, message_id in sorted((row[3], row[2]) for row in rows):
+                if not batches or batches[-1][0] != chat_id or len(batches[-1][1]) == DELETE_BATCH_SIZE:
+                    batches.append((chat_id, []))
+                batches[-1][1].append(message_id)
+
+            await run_pool(
+                batches,
+                delete,
+                # delete_chat_messages takes the limiter for each of its requests
+                limiter=None,
+                workers=DELETE_WORKERS,
+                name=f"delete_messages {', '.join(types)}",
+            )
+            await models.MessageToDelete.objects.filter(pk__in=[row[2] for row in rows]).adelete()
 
 
 class Notification:
@@ -448,41 +545,54 @@ class Notification:
             return None
 
     @staticmethod
-    async def get_tg_id(obj: (models.ActivityRecord | models.ConsultationRecord
-                              | models.User | models.Transfer | models.Living)):
-        if isinstance(obj, models.User):
-            tg_id = obj.tg_id
-        else:
-            tg_id = obj.user.tg_id
+    async def get_chat_ids(objects: QuerySet, user: str = "user__") -> list[int | None]:
+        """
+        Telegram ids of the recipients read with one query,
+        None for users who did not start the bot or blocked it
 
-        return tg_id
+        :param objects: users or records of users
+        :param user: lookup of the user from the objects, empty for users
+        """
+        rows = objects.values_list(f"{user}tg_id", f"{user}is_reachable")
+        return [tg_id if is_reachable else None async for tg_id, is_reachable in rows]
 
     @staticmethod
-    async def send_notifs_by_manager(notif_type: str, bot: Bot, pk: int | list = None, notif_text: str = None):
-        send_count = 0
+    async def group_chat_ids(records: QuerySet, entity_field: str) -> dict[int, list[int | None]]:
+        """
+        Telegram ids of the users of the records grouped by the entity they belong to, read with one query.
+        None stands for users who did not start the bot or blocked it
+
+        :param records: records of users
+        :param entity_field: name of the entity foreign key
+        """
+        chat_ids = {}
+        rows = records.values_list(f"{entity_field}_id", "user__tg_id", "user__is_reachable")
+        async for entity_id, tg_id, is_reachable in rows:
+            chat_ids.setdefault(entity_id, []).append(tg_id if is_reachable else None)
+        return chat_ids
 
-        objects = []
+    @staticmethod
+    async def create_job_by_manager(notif_type: str, pk: int | list = None, notif_text: str = None):
+        chat_ids = []
         reply_markup = None
-        bot_msg = None
 
         match notif_type:
             case "activity":
-                activity = await models.Activity.objects.aget(pk=pk)
-                objects = models.ActivityRecord.objects.select_related().filter(activity=activity)
+                chat_ids = await Notification.get_chat_ids(models.ActivityRecord.objects.filter(activity_id=pk))
 
             case "consultation":
-                consultation = await models.Consultation.objects.aget(pk=pk)
-                objects = models.ConsultationRecord.objects.select_related().filter(consultation=consultation)
+                chat_ids = await Notification.get_chat_ids(models.ConsultationRecord.objects.filter(consultation_id=pk))
 
             case "roles":
-                objects = models.User.objects.filter(status__in=pk)
+                chat_ids = await Notification.get_chat_ids(models.User.objects.filter(status__in=pk), user="")
 
             case "person":
-                objects = models.User.objects.filter(pk=pk)
+                chat_ids = await Notification.get_chat_ids(models.User.objects.filter(pk=pk), user="")
 
             case "feedback":
                 event = await models.Event.objects.aget(pk=pk)
-                objects = models.User.objects.filter(~Q(status="manager"))
+                users = models.User.objects.filter(~Q(status="manager"))
+                chat_ids = await Notification.get_chat_ids(users, user="")
                 notif_text = notif_text.format(name=event.name)
                 kb_builder = InlineKeyboardBuilder()
                 new_button = InlineKeyboardButton(text="Оценить",
@@ -490,29 +600,56 @@ class Notification:
                 kb_builder.add(new_button)
                 reply_markup = kb_builder.as_markup()
 
-        async for obj in objects:
-            try:
-                bot_msg = await bot.send_message(chat_id=await Notification.get_tg_id(obj=obj),
-                                                 text=notif_text,
-                                                 reply_markup=reply_markup)
-                await Utils.add_message_to_delete(
-                    message_id=bot_msg.message_id,
-                    chat_id=bot_msg.chat.id,
-                    message_type="notif"
+        return await outbox.create_job(
+            notif_type=notif_type,
+            deliveries=[Delivery(chat_id=chat_id, text=notif_text) for chat_id in chat_ids],
+            text=notif_text,
+            reply_markup=reply_markup,
+            message_type="notif",
+            object_id=pk if notif_type == "feedback" else None,
+        )
+
+    @staticmethod
+    async def send_notifs_by_manager(notif_type: str, bot: Bot, pk: int | list = None, notif_text: str = None):
+        job = await Notification.create_job_by_manager(notif_type=notif_type, pk=pk, notif_text=notif_text)
+        job = await Notification.run_job(bot=bot, job=job)
+
+        return job.sent_count
+
+    @staticmethod
+    async def run_job(
+        bot: Bot, job: models.BroadcastJob, on_progress: Callable[[Progress], Awaitable[None]] | None = None
+    ) -> models.BroadcastJob:
+        """
+        Send a broadcast job and set the status of the objects it notified about
+        """
+        job = await outbox.run_job(bot=bot, job=job, on_progress=on_progress)
+        deliveries = models.BroadcastDelivery.objects.filter(job=job)
+
+        match job.notif_type:
+            case "transfer" | "living":
+                model = models.Transfer if job.notif_type == "transfer" else models.Living
+                await model.objects.filter(
+                    pk__in=deliveries.filter(status=models.BroadcastDelivery.Status.SENT).values("object_id")
+                ).aupdate(status="send")
+                await model.objects.filter(
+                    pk__in=deliveries.filter(status=models.BroadcastDelivery.Status.FAILED).values("object_id")
+                ).aupdate(status="failed")
+            case "activity" | "schedule" | "consultation" if job.object_id is not None:
+                model = {
+                    "activity": models.Activity,
+                    "schedule": models.Schedule,
+                    "consultation": models.Consultation,
+                }[job.notif_type]
+                await model.objects.filter(pk=job.object_id).aupdate(
+                    status="failed" if job.failed_count or job.skipped else "send"
+                )
+            case "feedback":
+                await models.Event.objects.filter(pk=job.object_id).aupdate(
+                    status="send" if job.sent_count else "failed"
                 )
-                if bot_msg:
-                    send_count += 1
-                await asyncio.sleep(0.034)
-            except Exception as e:
-                await sync_to_async(print)(e)
-
-        if notif_type == "feedback":
-            if bot_msg:
-                await models.Event.objects.filter(pk=pk).aupdate(status="send")
-            else:
-                await models.Event.objects.filter(pk=pk).aupdate(status="failed")
 
-        return send_count
+        return job
 
     @staticmethod
     async def send_notifs(notif_type: str, bot: Bot):
@@ -520,125 +657,97 @@ class Notification:
 
         match notif_type:
             case "transfer":
-                transfers = models.Transfer.objects.select_related().filter(
+                transfers = models.Transfer.objects.select_related("user").filter(
                     date__date=(date + datetime.timedelta(days=1)).date())
-                async for transfer in transfers:
-                    try:
-                        bot_msg = await bot.send_message(
-                            chat_id=transfer.user.tg_id,
+
+                async def deliveries():
+                    async for transfer in transfers:
+                        yield Delivery(
+                            chat_id=transfer.user.tg_id if transfer.user.is_reachable else None,
                             text=manager_text.transfer_notif.format(
                                 time=transfer.date.astimezone(pytz.timezone("Europe/Moscow")).time().strftime("%H:%M"),
                                 place=transfer.place,
                                 car_num=transfer.car_num,
                                 driver_num=transfer.driver_num
-                            )
+                            ),
+                            key=transfer.id
                         )
-                        await Utils.add_message_to_delete(
-                            message_id=bot_msg.message_id,
-                            chat_id=bot_msg.chat.id,
-                            message_type="transfer"
-                        )
-                        await models.Transfer.objects.filter(pk=transfer.id).aupdate(status="send")
-                    except Exception as e:
-                        await sync_to_async(print)(e)
-                        await models.Transfer.objects.filter(pk=transfer.id).aupdate(status="failed")
-                    await asyncio.sleep(1)
+
+                job = await outbox.create_job(notif_type="transfer", deliveries=deliveries(), message_type="transfer")
+                # Skipped recipients get no delivery, their transfers are failed here
+                await transfers.filter(Q(user__tg_id=None) | Q(user__is_reachable=False)).aupdate(status="failed")
+                await Notification.run_job(bot=bot, job=job)
             case "living":
-                livings = models.Living.objects.select_related().filter(date=(date + datetime.timedelta(days=1)).date())
-                async for living in livings:
-                    try:
-                        bot_msg = await bot.send_message(
-                            chat_id=living.user.tg_id,
+                livings = models.Living.objects.select_related("user").filter(
+                    date=(date + datetime.timedelta(days=1)).date())
+
+                async def deliveries():
+                    async for living in livings:
+                        yield Delivery(
+                            chat_id=living.user.tg_id if living.user.is_reachable else None,
                             text=manager_text.living_notif.format(
                                 room=living.room,
                                 build=living.build
-                            )
+                            ),
+                            key=living.id
                         )
-                        await Utils.add_message_to_delete(
-                            message_id=bot_msg.message_id,
-                            chat_id=bot_msg.chat.id,
-                            message_type="living"
-                        )
-                        await models.Living.objects.filter(pk=living.id).aupdate(status="send")
-                    except Exception as e:
-                        await sync_to_async(print)(e)
-                        await models.Living.objects.filter(pk=living.id).aupdate(status="failed")
-                    await asyncio.sleep(1)
+
+                job = await outbox.create_job(notif_type="living", deliveries=deliveries(), message_type="living")
+                await livings.filter(Q(user__tg_id=None) | Q(user__is_reachable=False)).aupdate(status="failed")
+                await Notification.run_job(bot=bot, job=job)
             case "activity":
                 activities = models.Activity.objects.filter(date__date=(date + datetime.timedelta(days=1)).date())
+                chat_ids = await Notification.group_chat_ids(
+                    models.ActivityRecord.objects.filter(activity__in=activities), entity_field="activity"
+                )
                 async for activity in activities:
-                    records = models.ActivityRecord.objects.select_related().filter(activity=activity)
-                    notif_text = activity.template
-                    failed = None
-                    async for record in records:
-                        try:
-                            bot_msg = await bot.send_message(
-                                chat_id=record.user.tg_id,
-                                text=notif_text
-                            )
-                            await Utils.add_message_to_delete(
-                                message_id=bot_msg.message_id,
-                                chat_id=bot_msg.chat.id,
-                                message_type="activity"
-                            )
-                        except Exception as e:
-                            await sync_to_async(print)(e)
-                            failed = True
-                        await asyncio.sleep(1)
-                    if not failed:
-                        await models.Activity.objects.filter(pk=activity.id).aupdate(status="send")
-                    else:
-                        await models.Activity.objects.filter(pk=activity.id).aupdate(status="failed")
+                    job = await outbox.create_job(
+                        notif_type="activity",
+                        deliveries=[
+                            Delivery(chat_id=chat_id, text=activity.template)
+                            for chat_id in chat_ids.get(activity.id, [])
+                        ],
+                        text=activity.template,
+                        message_type="activity",
+                        object_id=activity.id,
+                    )
+                    await Notification.run_job(bot=bot, job=job)
 
             case "schedule":
                 schedules = models.Schedule.objects.filter(date=date.date())
                 users = models.User.objects.filter(~Q(status="manager"))
+                chat_ids = await Notification.get_chat_ids(users, user="")
                 async for schedule in schedules:
-                    async for user in users:
-                        try:
-                            bot_msg = await bot.send_message(
-                                chat_id=user.tg_id,
-                                text=schedule.template
-                            )
-                            await Utils.add_message_to_delete(
-                                message_id=bot_msg.message_id,
-                                chat_id=bot_msg.chat.id,
-                                message_type="schedule"
-                            )
-                            await models.Schedule.objects.filter(pk=schedule.id).aupdate(status="send")
-                        except Exception as e:
-                            await sync_to_async(print)(e)
-                            await models.Schedule.objects.filter(pk=schedule.id).aupdate(status="failed")
-                        await asyncio.sleep(1)
+                    job = await outbox.create_job(
+                        notif_type="schedule",
+                        deliveries=[Delivery(chat_id=chat_id, text=schedule.template) for chat_id in chat_ids],
+                        text=schedule.template,
+                        message_type="schedule",
+                        object_id=schedule.id,
+                    )
+                    await Notification.run_job(bot=bot, job=job)
             case "consultation":
-                consultations = models.Consultation.objects.select_related().filter(
+                consultations = models.Consultation.objects.select_related("expert", "interval").filter(
                     interval__date=date.date())
+                chat_ids = await Notification.group_chat_ids(
+                    models.ConsultationRecord.objects.filter(consultation__interval__date=date.date()),
+                    entity_field="consultation"
+                )
                 async for consultation in consultations:
-                    records = models.ConsultationRecord.objects.select_related().filter(consultation=consultation)
                     notif_text = manager_text.consultation_notif.format(
                         expert=f"{consultation.expert.last_name} {consultation.expert.first_name}",
                         date=f"{consultation.interval.date.strftime('%d %B')} "
                              f"в {consultation.start_time.strftime('%H:%M')}")
-                    failed = None
-                    async for record in records:
-                        try:
-                            bot_msg = await bot.send_message(
-                                chat_id=record.user.tg_id,
-                                text=notif_text
-                            )
-                            await Utils.add_message_to_delete(
-                                message_id=bot_msg.message_id,
-                                chat_id=bot_msg.chat.id,
-                                message_type="consultation"
-                            )
-                        except Exception as e:
-                            await sync_to_async(print)(e)
-                            failed = True
-                        await asyncio.sleep(1)
-                    if not failed:
-                        await models.Consultation.objects.filter(pk=consultation.id).aupdate(status="send")
-                    else:
-                        await models.Consultation.objects.filter(pk=consultation.id).aupdate(status="failed")
+                    job = await outbox.create_job(
+                        notif_type="consultation",
+                        deliveries=[
+                            Delivery(chat_id=chat_id, text=notif_text) for chat_id in chat_ids.get(consultation.id, [])
+                        ],
+                        text=notif_text,
+                        message_type="consultation",
+                        object_id=consultation.id,
+                    )
+                    await Notification.run_job(bot=bot, job=job)
 
     @staticmethod
     async def feedback_send(tg_id: int, pk: int, feedback_dict: dict):
@@ -655,48 +764,6 @@ class Notification:
         return status
 
 
-class SpamFilter(BaseFilter):
-    async def __call__(self, message: Message, state: FSMContext, bot: Bot) -> Union[bool, Dict[str, Any]]:
-        data = await state.get_data()
-        new_message = int(time.time())
-        old_message = data.get("old_message")
-        spam_count = data.get("spam_count")
-        if not spam_count:
-            spam_count = 0
-
-        if old_message and new_message - old_message >= 60:
-            await Utils.delete_message_by_type(chat_id=message.chat.id, message_types=["flood"], bot=bot)
-            await state.update_data({"old_message": new_message, "spam_count": 0, "is_banned": False})
-            return True
-
-        elif spam_count >= 8:
-            await message.delete()
-            is_banned = data.get("is_banned")
-            if not is_banned:
-                flood_msg = await message.answer(
-                    "Антифлуд система!\n"
-                    "Подождите 60 секунд."
-                )
-                await Utils.add_message_to_delete(
-                    message_id=flood_msg.message_id,
-                    chat_id=flood_msg.chat.id,
-                    message_type="flood"
-                )
-            await state.update_data(
-                {
-                    "old_message": new_message,
-                    "is_banned": True
-                }
-            )
-            return False
-
-        elif old_message and new_message - old_message <= 5:
-            await state.update_data({"spam_count": int(spam_count + 1)})
-
-        await state.update_data({"old_message": new_message})
-        return True
-
-
 def or_f_list(*targets: "CallbackType") -> _OrFilter:
     from aiogram.dispatcher.event.handler import FilterObject
     target_list = []
@@ -0,0 +1,215 @@
+import datetime
+import time
+
+import pytz
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.methods import SendMessage, TelegramMethod
+from aiogram.methods.base import TelegramType
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from app.apps.pish import models
+from app.apps.pish.bot.buffers import message_buffer
+from app.apps.pish.bot.utils import Notification
+from app.config.bot import TG_TOKEN
+
+from .mock_bot_api import add_mock_arguments, create_mock
+
+USERNAME_PREFIX = "loadtest_"
+# Far above real Telegram ids, so seeded users never collide with real ones
+TG_ID_BASE = 9 * 10 ** 12
+NOTIF_TYPES = ("roles", "transfer", "living", "activity", "schedule", "consultation")
+
+
+class SendLatency(BaseRequestMiddleware):
+    def __init__(self) -> None:
+        self.latencies = []
+
+    async def __call__(
+        self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot, method: TelegramMethod[TelegramType]
+    ) -> TelegramType:
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            if isinstance(method, SendMessage):
+                self.latencies.append(time.perf_counter() - started)
+
+
+class QueryCounter:
+    def __init__(self) -> None:
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed users and send every notification type through a mock Bot API, reporting throughput, "
+        "send latency and database queries. Run it against a scratch database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000, help="number of seeded users")
+        parser.add_argument("--entities", type=int, default=3,
+                            help="number of seeded activities and consultations, users are split between them")
+        parser.add_argument("--types", nargs="+", choices=NOTIF_TYPES, default=NOTIF_TYPES)
+        parser.add_argument("--server", default="",
+                            help="base URL of a running Bot API mock, by default one is started in process")
+        parser.add_argument("--keep", action="store_true", help="keep the seeded rows")
+        parser.add_argument("--force", action="store_true",
+                            help="run even though the database has users that were not seeded by this command")
+        add_mock_arguments(parser)
+
+    def handle(self, *args, **options):
+        if models.User.objects.exclude(username__startswith=USERNAME_PREFIX).exists() and not options["force"]:
+            raise CommandError(
+                "The database has real users, the schedule sweep would include them. Use a scratch database or --force"
+            )
+        if models.User.objects.filter(username__startswith=USERNAME_PREFIX).exists():
+            raise CommandError("Users seeded by a previous run with --keep are still in the database")
+
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            async_to_sync(self.run)(options, queries)
+
+    async def run(self, options, queries: QueryCounter):
+        mock = None
+        server = options["server"]
+        if not server:
+            mock = create_mock(options)
+            server = await mock.start()
+
+        latency = SendLatency()
+        bot = Bot(token=TG_TOKEN, parse_mode="HTML", session=AiohttpSession(api=TelegramAPIServer.from_base(server)))
+        bot.session.middleware(latency)
+
+        first_job = await models.BroadcastJob.objects.order_by("-id").values_list("id", flat=True).afirst() or 0
+        last_job = first_job
+        seeded = await self.seed(options["users"], options["entities"])
+        self.stdout.write(f"Seeded {options['users']} users, sending through {server}")
+        try:
+            for notif_type in options["types"]:
+                latency.latencies.clear()
+                queries.count = 0
+                requests = sum(mock.requests.values()) if mock else 0
+                started = time.perf_counter()
+
+                if notif_type == "roles":
+                    await Notification.send_notifs_by_manager(
+                        notif_type="roles", bot=bot, pk=[models.User.Status.USER], notif_text="Нагрузочный тест"
+                    )
+                else:
+                    await Notification.send_notifs(notif_type=notif_type, bot=bot)
+
+                elapsed = time.perf_counter() - started
+                query_count = queries.count
+                jobs = models.BroadcastJob.objects.filter(id__gt=last_job)
+                totals = await jobs.aaggregate(
+                    sent=Count("deliveries", filter=Q(deliveries__status=models.BroadcastDelivery.Status.SENT)),
+                    failed=Count("deliveries", filter=Q(deliveries__status=models.BroadcastDelivery.Status.FAILED)),
+                )
+                skipped = sum([skipped async for skipped in jobs.values_list("skipped", flat=True)])
+                last_job = await models.BroadcastJob.objects.order_by("-id").values_list("id", flat=True).afirst() or 0
+
+                line = (
+                    f"{notif_type:>12}: {totals['sent']} sent, {totals['failed']} failed, {skipped} skipped "
+                    f"in {elapsed:.1f}s, {totals['sent'] / elapsed:.1f} msgs/s, "
+                    f"p50 {percentile(latency.latencies, 0.5) * 1000:.0f}ms, "
+                    f"p99 {percentile(latency.latencies, 0.99) * 1000:.0f}ms, {query_count} queries"
+                )
+                if mock:
+                    line += f", {sum(mock.requests.values()) - requests} API requests"
+                self.stdout.write(line)
+        finally:
+            await message_buffer.close()
+            await bot.session.close()
+            if mock:
+                self.stdout.write(f"Mock errors: {dict(mock.errors)}")
+                await mock.close()
+            if not options["keep"]:
+                await self.cleanup(seeded, first_job)
+
+    async def seed(self, users: int, entities: int) -> dict:
+        now = timezone.now().astimezone(pytz.timezone("Europe/Moscow"))
+        tomorrow = (now + datetime.timedelta(days=1)).replace(hour=12, minute=0, second=0, microsecond=0)
+
+        await models.User.objects.abulk_create([
+            models.User(
+                tg_id=TG_ID_BASE + i,
+                username=f"{USERNAME_PREFIX}{i}",
+                first_name="Тест",
+                last_name=str(i),
+                status=models.User.Status.USER,
+            )
+            for i in range(users)
+        ])
+        user_ids = [pk async for pk in models.User.objects.filter(
+            username__startswith=USERNAME_PREFIX
+        ).order_by("tg_id").values_list("id", flat=True)]
+
+        activities = [
+            await models.Activity.objects.acreate(name=f"Нагрузочный тест {i}", date=tomorrow, template="Активность")
+            for i in range(entities)
+        ]
+        interval = await models.ConsultationInterval.objects.acreate(
+            date=now.date(), start_time=datetime.time(10), end_time=datetime.time(18)
+        )
+        consultations = [
+            await models.Consultation.objects.acreate(
+                expert_id=user_ids[0], interval=interval, start_time=datetime.time(10), max_count=users
+            )
+            for i in range(entities)
+        ]
+        schedule = await models.Schedule.objects.acreate(date=now.date(), template="Расписание")
+
+        await models.ActivityRecord.objects.abulk_create([
+            models.ActivityRecord(user_id=pk, activity=activities[i % entities]) for i, pk in enumerate(user_ids)
+        ])
+        await models.ConsultationRecord.objects.abulk_create([
+            models.ConsultationRecord(user_id=pk, consultation=consultations[i % entities])
+            for i, pk in enumerate(user_ids)
+        ])
+        await models.Transfer.objects.abulk_create([
+            models.Transfer(user_id=pk, date=tomorrow, place="Тест", car_num="Тест", driver_num="Тест")
+            for pk in user_ids
+        ])
+        await models.Living.objects.abulk_create([
+            models.Living(user_id=pk, room="1", build="1", date=tomorrow.date()) for pk in user_ids
+        ])
+        return {
+            "users": user_ids,
+            "activities": [activity.pk for activity in activities],
+            "consultations": [consultation.pk for consultation in consultations],
+            "interval": interval.pk,
+            "schedule": schedule.pk,
+        }
+
+    async def cleanup(self, seeded: dict, first_job: int) -> None:
+        users = seeded["users"]
+        await models.ActivityRecord.objects.filter(user_id__in=users).adelete()
+        await models.ConsultationRecord.objects.filter(user_id__in=users).adelete()
+        await models.Transfer.objects.filter(user_id__in=users).adelete()
+        await models.Living.objects.filter(user_id__in=users).adelete()
+        await models.Activity.objects.filter(pk__in=seeded["activities"]).adelete()
+        await models.Consultation.objects.filter(pk__in=seeded["consultations"]).adelete()
+        await models.ConsultationInterval.objects.filter(pk=seeded["interval"]).adelete()
+        await models.Schedule.objects.filter(pk=seeded["schedule"]).adelete()
+        await models.MessageToDelete.objects.filter(chat_id__gte=TG_ID_BASE).adelete()
+        await models.BroadcastJob.objects.filter(id__gt=first_job).adelete()
+        await models.User.objects.filter(pk__in=users).adelete()
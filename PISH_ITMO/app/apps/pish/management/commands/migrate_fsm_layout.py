@@ -0,0 +1,74 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from app.apps.pish.models import Storage, StorageRecord
+from app.config.bot import TG_TOKEN
+
+
+class Command(BaseCommand):
+    help = "Copy FSM rows keyed by DefaultKeyBuilder strings into the integer-keyed StorageRecord table"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bot-id", type=int, default=None,
+                            help="bot id of keys built without it, taken from TG_TOKEN by default")
+        parser.add_argument("--prefix", default="fsm")
+        parser.add_argument("--separator", default=":")
+        parser.add_argument("--with-bot-id", action="store_true")
+        parser.add_argument("--with-destiny", action="store_true")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--delete-old", action="store_true", help="delete migrated rows from the storage table")
+
+    def parse_key(self, key: str, options) -> tuple | None:
+        parts = key.split(options["separator"])
+        if parts[0] != options["prefix"]:
+            return None
+        middle = parts[1:-1]
+        try:
+            bot_id = int(middle.pop(0)) if options["with_bot_id"] else options["bot_id"]
+            chat_id, user_id = int(middle[0]), int(middle[1])
+        except (IndexError, ValueError):
+            return None
+        destiny = middle[2] if options["with_destiny"] and len(middle) > 2 else "default"
+        return bot_id, chat_id, user_id, destiny
+
+    def handle(self, *args, **options):
+        if options["bot_id"] is None and not options["with_bot_id"]:
+            try:
+                options["bot_id"] = int(TG_TOKEN.split(":")[0])
+            except ValueError:
+                raise CommandError("Can't get bot id from TG_TOKEN, pass --bot-id")
+
+        records = {}
+        migrated_keys = []
+        for row in Storage.objects.only("key", "state", "data", "payload").iterator(chunk_size=options["batch_size"]):
+            record_key = self.parse_key(row.key, options)
+            if record_key is None:
+                self.stderr.write(f"Skipped unknown key {row.key}")
+                continue
+            record = records.setdefault(record_key, {"state": "", "data": None, "payload": None})
+            if row.state:
+                record["state"] = row.state
+            if row.payload is not None:
+                record["payload"] = bytes(row.payload)
+            elif row.data is not None:
+                record["data"] = json.loads(row.data) if isinstance(row.data, str) else row.data
+            migrated_keys.append(row.key)
+
+        with transaction.atomic():
+            StorageRecord.objects.bulk_create(
+                [
+                    StorageRecord(bot_id=bot_id, chat_id=chat_id, user_id=user_id, destiny=destiny, **record)
+                    for (bot_id, chat_id, user_id, destiny), record in records.items()
+                ],
+                batch_size=options["batch_size"],
+                update_conflicts=True,
+                unique_fields=["bot_id", "chat_id", "user_id", "destiny"],
+                update_fields=["state", "data", "payload"],
+            )
+            if options["delete_old"]:
+                for i in range(0, len(migrated_keys), options["batch_size"]):
+                    Storage.objects.filter(key__in=migrated_keys[i:i + options["batch_size"]]).delete()
+
+        self.stdout.write(f"Migrated {len(migrated_keys)} rows into {len(records)} records")
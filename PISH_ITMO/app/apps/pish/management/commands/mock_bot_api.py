@@ -0,0 +1,52 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from app.apps.pish.management.mock_api import MockBotAPI
+
+
+def add_mock_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.05, help="mean response time in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02, help="maximum deviation of the response time")
+    parser.add_argument("--rate-limit", type=float, default=30,
+                        help="requests per second answered without 429, 0 disables the limit")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="share of requests answered with 429 anyway")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--blocked-rate", type=float, default=0.0, help="share of chats that blocked the bot")
+    parser.add_argument("--not-found-rate", type=float, default=0.0, help="share of chats that do not exist")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def create_mock(options) -> MockBotAPI:
+    return MockBotAPI(
+        latency=options["latency"],
+        jitter=options["jitter"],
+        rate_limit=options["rate_limit"],
+        flood_rate=options["flood_rate"],
+        retry_after=options["retry_after"],
+        blocked_rate=options["blocked_rate"],
+        not_found_rate=options["not_found_rate"],
+        seed=options["seed"],
+    )
+
+
+class Command(BaseCommand):
+    help = "Serve a mock of the Telegram Bot API, point the bot at it with TG_API_SERVER"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8081)
+        add_mock_arguments(parser)
+
+    def handle(self, *args, **options):
+        asyncio.run(self.serve(options))
+
+    async def serve(self, options):
+        mock = create_mock(options)
+        url = await mock.start(host=options["host"], port=options["port"])
+        self.stdout.write(f"Serving mock Bot API, set TG_API_SERVER={url}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await mock.close()
+            self.stdout.write(f"Requests: {dict(mock.requests)}, errors: {dict(mock.errors)}")
@@ -0,0 +1,32 @@
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+
+from app.apps.pish.bot.utils import Utils
+from app.apps.pish.models import MessageToDelete
+from app.config.bot import TG_API_SERVER, TG_TOKEN
+
+
+class Command(BaseCommand):
+    help = "Delete tracked messages of the given types from the chats right away, regardless of their lifetime"
+
+    def add_arguments(self, parser):
+        parser.add_argument("types", nargs="+", choices=MessageToDelete.Type.values)
+        parser.add_argument("--next-day", action="store_true", help="only delete messages sent yesterday")
+
+    def handle(self, *args, **options):
+        async_to_sync(self.purge)(options)
+
+    async def purge(self, options):
+        bot = Bot(
+            token=TG_TOKEN,
+            parse_mode="HTML",
+            session=AiohttpSession(api=TelegramAPIServer.from_base(TG_API_SERVER) if TG_API_SERVER else PRODUCTION),
+        )
+        try:
+            await Utils.delete_messages(bot=bot, types=options["types"], next_day=options["next_day"])
+        finally:
+            await bot.session.close()
+        self.stdout.write(f"Purged messages of types: {', '.join(options['types'])}")
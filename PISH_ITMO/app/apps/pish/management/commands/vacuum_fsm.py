@@ -0,0 +1,34 @@
+import datetime
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from app.apps.pish.bot.storage import DjangoStorage
+from app.apps.pish.models import Storage, StorageRecord
+from app.config.bot import FSM_IDLE_TTL_DAYS
+
+
+class Command(BaseCommand):
+    help = "Delete stale FSM storage rows and vacuum the storage tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=FSM_IDLE_TTL_DAYS,
+                            help="delete rows not written for this many days")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--no-vacuum", action="store_true",
+                            help="only delete rows, skip VACUUM on PostgreSQL")
+
+    def handle(self, *args, **options):
+        deleted = async_to_sync(DjangoStorage.delete_stale)(
+            idle_ttl=datetime.timedelta(days=options["days"]),
+            batch_size=options["batch_size"],
+        )
+        self.stdout.write(f"Deleted {deleted} stale FSM rows")
+
+        if options["no_vacuum"] or connection.vendor != "postgresql":
+            return
+        with connection.cursor() as cursor:
+            for model in (Storage, StorageRecord):
+                cursor.execute(f"VACUUM (ANALYZE) {connection.ops.quote_name(model._meta.db_table)}")
+                self.stdout.write(f"Vacuumed {model._meta.db_table} table")
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+
+
+class MockBotAPI:
+    """
+    Local stand-in for the Telegram Bot API, to measure broadcasts without real users.
+
+    Every request waits latency ± jitter seconds. Requests above rate_limit per second
+    and a flood_rate share of the rest get 429 with retry_after. Chats are blocked or
+    not found with the given probabilities, decided once per chat so retries fail too.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.05,
+        jitter: float = 0.02,
+        rate_limit: float = 30,
+        flood_rate: float = 0.0,
+        retry_after: int = 1,
+        blocked_rate: float = 0.0,
+        not_found_rate: float = 0.0,
+        seed: int = 0,
+    ) -> None:
+        """
+        :param latency: mean response time in seconds
+        :param jitter: maximum deviation of the response time in seconds
+        :param rate_limit: requests per second answered without 429, 0 disables the limit
+        :param flood_rate: share of the requests answered with 429 anyway
+        :param retry_after: retry_after of the 429 responses
+        :param blocked_rate: share of the chats that blocked the bot
+        :param not_found_rate: share of the chats that do not exist
+        :param seed: seed of the random choices
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.blocked_rate = blocked_rate
+        self.not_found_rate = not_found_rate
+        self.seed = seed
+        self.requests: Counter = Counter()
+        self.errors: Counter = Counter()
+        self._random = random.Random(seed)
+        self._message_ids: Counter = Counter()
+        self._tokens = rate_limit
+        self._updated_at = time.monotonic()
+        self._runner: Optional[web.AppRunner] = None
+
+    def chat_error(self, chat_id: int) -> Optional[tuple]:
+        """
+        Error profile of a chat, None if messages are delivered
+        """
+        roll = random.Random(f"{self.seed}:{chat_id}").random()
+        if roll < self.blocked_rate:
+            return 403, "Forbidden: bot was blocked by the user"
+        if roll < self.blocked_rate + self.not_found_rate:
+            return 400, "Bad Request: chat not found"
+        return None
+
+    def _flooded(self) -> bool:
+        if self.flood_rate and self._random.random() < self.flood_rate:
+            return True
+        if not self.rate_limit:
+            return False
+        # Token bucket holding one second of requests
+        now = time.monotonic()
+        self._tokens = min(self.rate_limit, self._tokens + (now - self._updated_at) * self.rate_limit)
+        self._updated_at = now
+        if self._tokens < 1:
+            return True
+        self._tokens -= 1
+        return False
+
+    @staticmethod
+    def _ok(result: Any) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    def _error(code: int, description: str, **parameters: Any) -> web.Response:
+        body: Dict[str, Any] = {"ok": False, "error_code": code, "description": description}
+        if parameters:
+            body["parameters"] = parameters
+        return web.json_response(body, status=code)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        data = dict(await request.post())
+        self.requests[method] += 1
+        await asyncio.sleep(max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter)))
+
+        if method == "getme":
+            return self._ok({"id": 1, "is_bot": True, "first_name": "Mock", "username": "mock_bot"})
+        if self._flooded():
+            self.errors[429] += 1
+            return self._error(
+                429, f"Too Many Requests: retry after {self.retry_after}", retry_after=self.retry_after
+            )
+
+        chat_id = int(data.get("chat_id", 0))
+        error = self.chat_error(chat_id)
+        if error is not None:
+            self.errors[error[0]] += 1
+            return self._error(*error)
+
+        if method == "sendmessage":
+            self._message_ids[chat_id] += 1
+            message = {
+                "message_id": self._message_ids[chat_id],
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": data.get("text", ""),
+            }
+            if data.get("reply_markup"):
+                message["reply_markup"] = json.loads(data["reply_markup"])
+            return self._ok(message)
+        return self._ok(True)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Start serving, port 0 picks a free one
+
+        :return: base URL for TelegramAPIServer.from_base
+        """
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        return f"http://{host}:{port}"
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
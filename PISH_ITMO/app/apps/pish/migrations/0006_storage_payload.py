@@ -0,0 +1,53 @@
+# Generated by Django 4.1.5 on 2026-10-18 11:35
+
+import json
+
+import msgpack
+from django.db import migrations, models
+
+
+def decode_data(apps, schema_editor):
+    Storage = apps.get_model("pish", "Storage")
+    batch = []
+    for row in Storage.objects.filter(data__isnull=False).only("key", "data").iterator(chunk_size=1000):
+        if isinstance(row.data, str):
+            row.data = json.loads(row.data)
+            batch.append(row)
+        if len(batch) >= 1000:
+            Storage.objects.bulk_update(batch, ["data"])
+            batch = []
+    if batch:
+        Storage.objects.bulk_update(batch, ["data"])
+
+
+def encode_data(apps, schema_editor):
+    Storage = apps.get_model("pish", "Storage")
+    batch = []
+    rows = Storage.objects.exclude(data__isnull=True, payload__isnull=True).only("key", "data", "payload")
+    for row in rows.iterator(chunk_size=1000):
+        if row.payload is not None:
+            row.data = json.dumps(msgpack.unpackb(row.payload, raw=False, strict_map_key=False))
+            batch.append(row)
+        elif not isinstance(row.data, str):
+            row.data = json.dumps(row.data)
+            batch.append(row)
+        if len(batch) >= 1000:
+            Storage.objects.bulk_update(batch, ["data"])
+            batch = []
+    if batch:
+        Storage.objects.bulk_update(batch, ["data"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("pish", "0005_alter_consultation_start_time_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="storage",
+            name="payload",
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.RunPython(decode_data, encode_data),
+    ]
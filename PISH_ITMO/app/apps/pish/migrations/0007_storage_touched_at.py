@@ -0,0 +1,17 @@
+# Generated by Django 4.1.5 on 2026-10-18 11:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("pish", "0006_storage_payload"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="storage",
+            name="touched_at",
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name="Последнее обращение"),
+        ),
+    ]
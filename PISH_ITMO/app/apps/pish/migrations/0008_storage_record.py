@@ -0,0 +1,37 @@
+# Generated by Django 4.1.5 on 2026-10-18 11:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("pish", "0007_storage_touched_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StorageRecord",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("bot_id", models.BigIntegerField(verbose_name="Bot ID")),
+                ("chat_id", models.BigIntegerField(verbose_name="Chat ID")),
+                ("user_id", models.BigIntegerField(verbose_name="User ID")),
+                ("destiny", models.CharField(default="default", max_length=32, verbose_name="Назначение")),
+                ("data", models.JSONField(blank=True, null=True)),
+                ("payload", models.BinaryField(blank=True, null=True)),
+                ("state", models.CharField(blank=True, max_length=50)),
+                ("touched_at", models.DateTimeField(auto_now=True, db_index=True, verbose_name="Последнее обращение")),
+            ],
+            options={
+                "verbose_name": "запись хранилища",
+                "verbose_name_plural": "записи хранилища",
+                "db_table": "storage_record",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="storagerecord",
+            constraint=models.UniqueConstraint(
+                fields=("bot_id", "chat_id", "user_id", "destiny"), name="storage_record_key"
+            ),
+        ),
+    ]
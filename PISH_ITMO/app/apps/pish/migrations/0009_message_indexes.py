@@ -0,0 +1,20 @@
+# Generated by Django 4.1.5 on 2026-10-18 11:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("pish", "0008_storage_record"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="messagetodelete",
+            index=models.Index(fields=["chat_id", "type"], name="message_chat_type_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="messagetodelete",
+            index=models.Index(fields=["type", "created_at"], name="message_type_created_idx"),
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 4.1.5 on 2026-10-18 11:50
+
+import datetime
+
+from django.db import migrations, models
+
+# Lifetimes close to the cron sweeps they replace
+DEFAULT_POLICIES = {
+    "imenu": datetime.timedelta(hours=12),
+    "notif": datetime.timedelta(hours=12),
+    "feedback": datetime.timedelta(hours=12),
+    "general": datetime.timedelta(hours=12),
+    "schedule": datetime.timedelta(hours=16),
+    "consultation": datetime.timedelta(hours=3),
+    "activity": datetime.timedelta(hours=20),
+    "transfer": datetime.timedelta(hours=28),
+    "living": datetime.timedelta(hours=28),
+}
+
+
+def create_policies(apps, schema_editor):
+    DeletionPolicy = apps.get_model("pish", "DeletionPolicy")
+    MessageToDelete = apps.get_model("pish", "MessageToDelete")
+    DeletionPolicy.objects.bulk_create(
+        [DeletionPolicy(type=message_type, lifetime=lifetime) for message_type, lifetime in DEFAULT_POLICIES.items()]
+    )
+    for message_type, lifetime in DEFAULT_POLICIES.items():
+        MessageToDelete.objects.filter(type=message_type).update(expires_at=models.F("created_at") + lifetime)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("pish", "0009_message_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeletionPolicy",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                (
+                    "type",
+                    models.CharField(
+                        choices=[
+                            ("imenu", "Inline Menu"),
+                            ("rmenu", "Reply Menu"),
+                            ("flood", "Flood"),
+                            ("notif", "Notification"),
+                            ("feedback", "Feedback"),
+                            ("activity", "Activity"),
+                            ("consultation", "Consultation"),
+                            ("transfer", "Transfer"),
+                            ("living", "Living"),
+                            ("schedule", "Schedule"),
+                            ("general", "General"),
+                        ],
+                        max_length=12,
+                        unique=True,
+                        verbose_name="Тип",
+                    ),
+                ),
+                (
+                    "lifetime",
+                    models.DurationField(
+                        help_text="Изменения применяются к новым сообщениям после перезапуска бота",
+                        verbose_name="Срок хранения",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "срок хранения сообщений",
+                "verbose_name_plural": "сроки хранения сообщений",
+                "db_table": "deletion_policy",
+            },
+        ),
+        migrations.AddField(
+            model_name="messagetodelete",
+            name="expires_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name="Удалить после"),
+        ),
+        migrations.RunPython(create_policies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,107 @@
+# Generated by Django 4.1.5 on 2026-10-18 11:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("pish", "0010_deletion_policy"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BroadcastJob",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("created_at", models.DateTimeField(auto_now_add=True, verbose_name="Создан")),
+                ("updated_at", models.DateTimeField(auto_now=True, verbose_name="Обновлён")),
+                ("notif_type", models.CharField(max_length=16, verbose_name="Тип уведомления")),
+                ("object_id", models.PositiveBigIntegerField(blank=True, null=True, verbose_name="ID объекта")),
+                (
+                    "message_type",
+                    models.CharField(
+                        blank=True,
+                        choices=[
+                            ("imenu", "Inline Menu"),
+                            ("rmenu", "Reply Menu"),
+                            ("flood", "Flood"),
+                            ("notif", "Notification"),
+                            ("feedback", "Feedback"),
+                            ("activity", "Activity"),
+                            ("consultation", "Consultation"),
+                            ("transfer", "Transfer"),
+                            ("living", "Living"),
+                            ("schedule", "Schedule"),
+                            ("general", "General"),
+                        ],
+                        max_length=12,
+                        verbose_name="Тип для удаления",
+                    ),
+                ),
+                ("text", models.TextField(blank=True, verbose_name="Текст")),
+                ("reply_markup", models.JSONField(blank=True, null=True, verbose_name="Клавиатура")),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[("pending", "В очереди"), ("running", "Отправляется"), ("done", "Завершена")],
+                        default="pending",
+                        max_length=8,
+                        verbose_name="Статус",
+                    ),
+                ),
+                ("finished_at", models.DateTimeField(blank=True, null=True, verbose_name="Завершена")),
+            ],
+            options={
+                "verbose_name": "рассылка",
+                "verbose_name_plural": "рассылки",
+                "db_table": "broadcast_job",
+                "ordering": ("-created_at",),
+            },
+        ),
+        migrations.CreateModel(
+            name="BroadcastDelivery",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("chat_id", models.BigIntegerField(blank=True, null=True, verbose_name="Chat ID")),
+                ("object_id", models.PositiveBigIntegerField(blank=True, null=True, verbose_name="ID объекта")),
+                ("text", models.TextField(blank=True, verbose_name="Текст")),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "В очереди"),
+                            ("sending", "Отправляется"),
+                            ("sent", "Доставлено"),
+                            ("failed", "Ошибка"),
+                        ],
+                        default="pending",
+                        max_length=8,
+                        verbose_name="Статус",
+                    ),
+                ),
+                ("attempts", models.PositiveSmallIntegerField(default=0, verbose_name="Попытки")),
+                ("error", models.TextField(blank=True, verbose_name="Ошибка")),
+                ("message_id", models.BigIntegerField(blank=True, null=True, verbose_name="Message ID")),
+                ("updated_at", models.DateTimeField(auto_now=True, verbose_name="Обновлена")),
+                (
+                    "job",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="deliveries",
+                        to="pish.broadcastjob",
+                        verbose_name="Рассылка",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "доставка рассылки",
+                "verbose_name_plural": "доставки рассылок",
+                "db_table": "broadcast_delivery",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="broadcastdelivery",
+            index=models.Index(fields=["job", "status"], name="broadcast_delivery_status_idx"),
+        ),
+    ]
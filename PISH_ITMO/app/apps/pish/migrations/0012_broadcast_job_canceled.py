@@ -0,0 +1,27 @@
+# Generated by Django 4.1.5 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("pish", "0011_broadcast_outbox"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="broadcastjob",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "В очереди"),
+                    ("running", "Отправляется"),
+                    ("done", "Завершена"),
+                    ("canceled", "Отменена"),
+                ],
+                default="pending",
+                max_length=8,
+                verbose_name="Статус",
+            ),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.1.5 on 2026-10-18 12:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("pish", "0012_broadcast_job_canceled"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="broadcastjob",
+            name="skipped",
+            field=models.PositiveIntegerField(default=0, verbose_name="Пропущено недоступных"),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="is_reachable",
+            field=models.BooleanField(
+                default=True,
+                help_text="Снимается, когда пользователь заблокировал бота, и возвращается после /start",
+                verbose_name="Доступен?",
+            ),
+        ),
+    ]
@@ -31,6 +31,9 @@ class User(CreateUpdateTracker):
     self_determination_map = models.URLField(blank=True, verbose_name="Карта самоопределения")
 
     status = models.CharField(max_length=8, choices=Status.choices, default=Status.USER, verbose_name="Роль")
+    is_reachable = models.BooleanField(default=True, verbose_name="Доступен?", help_text=(
+        "Снимается, когда пользователь заблокировал бота, и возвращается после /start"
+    ))
 
     def __str__(self):
         return f"{self.last_name} {self.first_name}"
@@ -289,17 +292,45 @@ class Storage(models.Model):
 
     key = models.CharField(max_length=256, primary_key=True, db_index=True)
     data = models.JSONField(max_length=1024, blank=True, null=True)
+    payload = models.BinaryField(blank=True, null=True)
     state = models.CharField(max_length=50, blank=True)
+    touched_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name="Последнее обращение")
 
     def __str__(self):
         return f"{self.key}"
 
 
+class StorageRecord(models.Model):
+    class Meta:
+        db_table = "storage_record"
+        verbose_name = "запись хранилища"
+        verbose_name_plural = "записи хранилища"
+        constraints = [
+            models.UniqueConstraint(fields=["bot_id", "chat_id", "user_id", "destiny"], name="storage_record_key"),
+        ]
+
+    bot_id = models.BigIntegerField(verbose_name="Bot ID")
+    chat_id = models.BigIntegerField(verbose_name="Chat ID")
+    user_id = models.BigIntegerField(verbose_name="User ID")
+    destiny = models.CharField(max_length=32, default="default", verbose_name="Назначение")
+    data = models.JSONField(blank=True, null=True)
+    payload = models.BinaryField(blank=True, null=True)
+    state = models.CharField(max_length=50, blank=True)
+    touched_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name="Последнее обращение")
+
+    def __str__(self):
+        return f"{self.chat_id}:{self.user_id}"
+
+
 class MessageToDelete(models.Model):
     class Meta:
         db_table = "message"
         verbose_name = "отложенное удаление"
         verbose_name_plural = "отложенные удаления"
+        indexes = [
+            models.Index(fields=["chat_id", "type"], name="message_chat_type_idx"),
+            models.Index(fields=["type", "created_at"], name="message_type_created_idx"),
+        ]
 
     class Type(models.TextChoices):
         IMENU = "imenu", "Inline Menu"
@@ -318,6 +349,80 @@ class MessageToDelete(models.Model):
     chat_id = models.PositiveBigIntegerField(verbose_name="Chat ID")
     type = models.CharField(max_length=12, choices=Type.choices, verbose_name="Тип")
     created_at = models.DateTimeField(db_index=True, auto_now_add=True, verbose_name="Создан")
+    expires_at = models.DateTimeField(blank=True, null=True, db_index=True, verbose_name="Удалить после")
 
     def __str__(self):
         return f"{self.id}"
+
+
+class DeletionPolicy(models.Model):
+    class Meta:
+        db_table = "deletion_policy"
+        verbose_name = "срок хранения сообщений"
+        verbose_name_plural = "сроки хранения сообщений"
+
+    type = models.CharField(max_length=12, choices=MessageToDelete.Type.choices, unique=True, verbose_name="Тип")
+    lifetime = models.DurationField(
+        verbose_name="Срок хранения",
+        help_text="Изменения применяются к новым сообщениям после перезапуска бота"
+    )
+
+    def __str__(self):
+        return f"{self.type}"
+
+
+class BroadcastJob(CreateUpdateTracker):
+    class Meta:
+        db_table = "broadcast_job"
+        verbose_name = "рассылка"
+        verbose_name_plural = "рассылки"
+        ordering = ("-created_at",)
+
+    class Status(models.TextChoices):
+        PENDING = "pending", "В очереди"
+        RUNNING = "running", "Отправляется"
+        DONE = "done", "Завершена"
+        CANCELED = "canceled", "Отменена"
+
+    notif_type = models.CharField(max_length=16, verbose_name="Тип уведомления")
+    object_id = models.PositiveBigIntegerField(blank=True, null=True, verbose_name="ID объекта")
+    message_type = models.CharField(
+        max_length=12, choices=MessageToDelete.Type.choices, blank=True, verbose_name="Тип для удаления"
+    )
+    text = models.TextField(blank=True, verbose_name="Текст")
+    reply_markup = models.JSONField(blank=True, null=True, verbose_name="Клавиатура")
+    status = models.CharField(max_length=8, choices=Status.choices, default=Status.PENDING, verbose_name="Статус")
+    finished_at = models.DateTimeField(blank=True, null=True, verbose_name="Завершена")
+    skipped = models.PositiveIntegerField(default=0, verbose_name="Пропущено недоступных")
+
+    def __str__(self):
+        return f"{self.notif_type} {self.created_at:%d.%m %H:%M}"
+
+
+class BroadcastDelivery(models.Model):
+    class Meta:
+        db_table = "broadcast_delivery"
+        verbose_name = "доставка рассылки"
+        verbose_name_plural = "доставки рассылок"
+        indexes = [
+            models.Index(fields=["job", "status"], name="broadcast_delivery_status_idx"),
+        ]
+
+    class Status(models.TextChoices):
+        PENDING = "pending", "В очереди"
+        SENDING = "sending", "Отправляется"
+        SENT = "sent", "Доставлено"
+        FAILED = "failed", "Ошибка"
+
+    job = models.ForeignKey(BroadcastJob, on_delete=models.CASCADE, related_name="deliveries", verbose_name="Рассылка")
+    chat_id = models.BigIntegerField(blank=True, null=True, verbose_name="Chat ID")
+    object_id = models.PositiveBigIntegerField(blank=True, null=True, verbose_name="ID объекта")
+    text = models.TextField(blank=True, verbose_name="Текст")
+    status = models.CharField(max_length=8, choices=Status.choices, default=Status.PENDING, verbose_name="Статус")
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Попытки")
+    error = models.TextField(blank=True, verbose_name="Ошибка")
+    message_id = models.BigIntegerField(blank=True, null=True, verbose_name="Message ID")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Обновлена")
+
+    def __str__(self):
+        return f"{self.job_id}:{self.chat_id}"
@@ -1,7 +1,7 @@
 import locale
 
 from django.contrib import admin
-from django.db.models import Avg
+from django.db.models import Avg, Count, Q
 from django.urls import reverse
 from django.utils.safestring import mark_safe
 
@@ -13,9 +13,12 @@ date_format = "%d.%m (%a) %H:%M"
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
-    fields = ("tg_id", "username", "first_name", "last_name", "self_determination_map", "status", "get_consultations")
-    list_display = ["tg_id", "username", "get_name", "status"]
-    list_filter = ["status"]
+    fields = (
+        "tg_id", "username", "first_name", "last_name", "self_determination_map", "status", "is_reachable",
+        "get_consultations"
+    )
+    list_display = ["tg_id", "username", "get_name", "status", "is_reachable"]
+    list_filter = ["status", "is_reachable"]
     search_fields = ("username", "tg_id", "last_name", "first_name")
     list_editable = ["status"]
     readonly_fields = ("get_consultations",)
@@ -218,15 +221,65 @@ class ScheduleAdmin(admin.ModelAdmin):
 @admin.register(Storage)
 class StorageAdmin(admin.ModelAdmin):
     search_fields = ("key", "data")
-    list_display = ["key", "data", "state"]
+    list_display = ["key", "data", "state", "touched_at"]
+
+
+@admin.register(StorageRecord)
+class StorageRecordAdmin(admin.ModelAdmin):
+    search_fields = ("chat_id", "user_id")
+    list_display = ["chat_id", "user_id", "destiny", "data", "state", "touched_at"]
 
 
 @admin.register(MessageToDelete)
 class MessageToDeleteAdmin(admin.ModelAdmin):
-    list_display = ["id", "chat_id", "type", "created_at"]
+    list_display = ["id", "chat_id", "type", "created_at", "expires_at"]
     search_fields = ("chat_id",)
     list_filter = ["type"]
 
 
+@admin.register(DeletionPolicy)
+class DeletionPolicyAdmin(admin.ModelAdmin):
+    list_display = ["type", "lifetime"]
+
+
+@admin.register(BroadcastJob)
+class BroadcastJobAdmin(admin.ModelAdmin):
+    list_display = [
+        "id", "notif_type", "object_id", "status", "sent_count", "failed_count", "pending_count", "skipped",
+        "created_at", "finished_at"
+    ]
+    list_filter = ["notif_type", "status"]
+    readonly_fields = ("created_at", "updated_at", "finished_at")
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            sent_count=Count("deliveries", filter=Q(deliveries__status=BroadcastDelivery.Status.SENT)),
+            failed_count=Count("deliveries", filter=Q(deliveries__status=BroadcastDelivery.Status.FAILED)),
+            pending_count=Count("deliveries", filter=Q(
+                deliveries__status__in=[BroadcastDelivery.Status.PENDING, BroadcastDelivery.Status.SENDING]
+            )),
+        )
+
+    @admin.display(ordering="sent_count", description="Доставлено")
+    def sent_count(self, object):
+        return object.sent_count
+
+    @admin.display(ordering="failed_count", description="Ошибок")
+    def failed_count(self, object):
+        return object.failed_count
+
+    @admin.display(ordering="pending_count", description="Осталось")
+    def pending_count(self, object):
+        return object.pending_count
+
+
+@admin.register(BroadcastDelivery)
+class BroadcastDeliveryAdmin(admin.ModelAdmin):
+    list_display = ["id", "job", "chat_id", "status", "attempts", "error", "updated_at"]
+    list_filter = ["status", "job"]
+    list_select_related = ("job",)
+    search_fields = ("chat_id",)
+
+
 admin.site.site_title = 'Админ-панель «ПИШ»'
 admin.site.site_header = 'Админ-панель «ПИШ»'
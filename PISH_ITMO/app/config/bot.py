@@ -2,4 +2,77 @@ from app.config import env
 
 TG_TOKEN = env("TG_TOKEN", cast=str)
 
+# Base URL of the Bot API server, e.g. a local Bot API server or the mock of manage.py mock_bot_api.
+# Empty for api.telegram.org
+TG_API_SERVER = env("TG_API_SERVER", cast=str, default="")
+
+# FSM backend: "django" (storage table) or "redis"
+FSM_STORAGE = env("FSM_STORAGE", cast=str, default="django")
+
 LOCALE = env("LOCALE", cast=str, default="ru")
+
+# Anti-flood: a user may send ANTIFLOOD_BURST messages or callbacks in a row,
+# one more every 1 / ANTIFLOOD_RATE seconds, and is muted for ANTIFLOOD_COOLDOWN seconds after that
+ANTIFLOOD_RATE = env("ANTIFLOOD_RATE", cast=float, default=0.5)
+ANTIFLOOD_BURST = env("ANTIFLOOD_BURST", cast=int, default=8)
+ANTIFLOOD_COOLDOWN = env("ANTIFLOOD_COOLDOWN", cast=float, default=60)
+
+# In-process FSM cache, 0 disables it
+FSM_CACHE_SIZE = env("FSM_CACHE_SIZE", cast=int, default=10000)
+FSM_CACHE_TTL = env("FSM_CACHE_TTL", cast=float, default=300)
+
+# Buffer FSM writes of an update and flush them once the update is handled
+FSM_WRITE_BUFFER = env("FSM_WRITE_BUFFER", cast=bool, default=True)
+
+# Keep FSM state and data in one storage row per key.
+# Switching it on resets the conversations stored in the old layout
+FSM_SINGLE_ROW = env("FSM_SINGLE_ROW", cast=bool, default=False)
+
+# FSM table layout: "key" (string keys in Storage) or "columns" (integer keys in StorageRecord).
+# Existing conversations are moved to the new layout with manage.py migrate_fsm_layout
+FSM_STORAGE_LAYOUT = env("FSM_STORAGE_LAYOUT", cast=str, default="key")
+
+# FSM data codec: "json" or "binary" (msgpack)
+FSM_STORAGE_CODEC = env("FSM_STORAGE_CODEC", cast=str, default="json")
+
+# Lock FSM keys with PostgreSQL advisory locks, needed when several bot processes share the database.
+# Such processes must also run with FSM_CACHE_SIZE=0, the FSM cache assumes a single writer
+FSM_ADVISORY_LOCKS = env("FSM_ADVISORY_LOCKS", cast=bool, default=False)
+
+# Storage rows not written for this many days are deleted by the nightly sweeper
+FSM_IDLE_TTL_DAYS = env("FSM_IDLE_TTL_DAYS", cast=int, default=30)
+
+# Scheduled message cleanup: concurrent requests, requests per second overall and per chat
+DELETE_WORKERS = env("DELETE_WORKERS", cast=int, default=16)
+DELETE_RATE = env("DELETE_RATE", cast=float, default=25)
+DELETE_CHAT_RATE = env("DELETE_CHAT_RATE", cast=float, default=1)
+DELETE_CHAT_BURST = env("DELETE_CHAT_BURST", cast=float, default=5)
+
+# Broadcasts: concurrent requests, messages per second overall and per chat
+BROADCAST_WORKERS = env("BROADCAST_WORKERS", cast=int, default=8)
+BROADCAST_RATE = env("BROADCAST_RATE", cast=float, default=28)
+BROADCAST_CHAT_RATE = env("BROADCAST_CHAT_RATE", cast=float, default=1)
+
+# Minimum time in seconds between edits of the progress message of a manager broadcast
+BROADCAST_PROGRESS_INTERVAL = env("BROADCAST_PROGRESS_INTERVAL", cast=float, default=5)
+
+# Broadcast outbox: deliveries saved with one query and deliveries marked as sending with one query.
+# Deliveries marked as sending when the bot stops are not sent again
+OUTBOX_BATCH_SIZE = env("OUTBOX_BATCH_SIZE", cast=int, default=500)
+OUTBOX_CLAIM_SIZE = env("OUTBOX_CLAIM_SIZE", cast=int, default=50)
+
+# Messages to delete are saved in batches of MESSAGE_BUFFER_SIZE rows or
+# every MESSAGE_BUFFER_INTERVAL seconds, MESSAGE_BUFFER_SIZE=0 saves each one right away
+MESSAGE_BUFFER_SIZE = env("MESSAGE_BUFFER_SIZE", cast=int, default=500)
+MESSAGE_BUFFER_INTERVAL = env("MESSAGE_BUFFER_INTERVAL", cast=float, default=2)
+
+# Number of chats whose menu messages are tracked in memory
+MENU_REGISTRY_SIZE = env("MENU_REGISTRY_SIZE", cast=int, default=10000)
+
+# Number of messages whose last edit is remembered to skip identical edits, 0 disables it
+EDIT_CACHE_SIZE = env("EDIT_CACHE_SIZE", cast=int, default=10000)
+
+# Redis FSM backend, TTLs are in seconds, 0 keeps records forever
+REDIS_URL = env("REDIS_URL", cast=str, default="redis://localhost:6379/0")
+FSM_STATE_TTL = env("FSM_STATE_TTL", cast=int, default=0)
+FSM_DATA_TTL = env("FSM_DATA_TTL", cast=int, default=0)
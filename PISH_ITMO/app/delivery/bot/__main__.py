@@ -1,21 +1,91 @@
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Tuple
 
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+from aiogram.fsm.storage.base import BaseEventIsolation, BaseStorage
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
+from app.apps.pish.bot.buffers import message_buffer
 from app.apps.pish.bot.menu.expert.router import router as expert_router
 from app.apps.pish.bot.menu.manager.router import router as manager_router
 from app.apps.pish.bot.menu.router import router as menu_router
 from app.apps.pish.bot.menu.user.router import router as user_router
+from app.apps.pish.bot.middlewares import (
+    AntiFloodMiddleware,
+    FSMWriteBufferMiddleware,
+    MenuCallbackMiddleware,
+    SkipUnmodifiedEditsMiddleware,
+)
+from app.apps.pish.bot.outbox import outbox
 from app.apps.pish.bot.registration.router import router as reg_router
-from app.apps.pish.bot.start_command.router import router as start_router
-from app.apps.pish.bot.storage import DjangoStorage
-from app.apps.pish.bot.utils import Notification, Utils
-from app.config.bot import TG_TOKEN
+from app.apps.pish.bot.scheduler import deletion_scheduler
+from app.apps.pish.bot.start_command.router import fallback_router, router as start_router
+from app.apps.pish.bot.storage import CachedStorage, DjangoEventIsolation, DjangoStorage, RedisStorage
+from app.apps.pish.bot.utils import Notification
+from app.config.bot import (
+    ANTIFLOOD_BURST,
+    ANTIFLOOD_COOLDOWN,
+    ANTIFLOOD_RATE,
+    EDIT_CACHE_SIZE,
+    FSM_ADVISORY_LOCKS,
+    FSM_CACHE_SIZE,
+    FSM_CACHE_TTL,
+    FSM_DATA_TTL,
+    FSM_IDLE_TTL_DAYS,
+    FSM_SINGLE_ROW,
+    FSM_STATE_TTL,
+    FSM_STORAGE,
+    FSM_STORAGE_CODEC,
+    FSM_STORAGE_LAYOUT,
+    FSM_WRITE_BUFFER,
+    REDIS_URL,
+    TG_API_SERVER,
+    TG_TOKEN,
+)
 
-bot = Bot(token=TG_TOKEN, parse_mode="HTML")
-dispatcher = Dispatcher(storage=DjangoStorage())
+
+def _create_storage() -> Tuple[BaseStorage, BaseEventIsolation]:
+    storage: BaseStorage
+    isolation: BaseEventIsolation
+    if FSM_STORAGE == "redis":
+        storage = RedisStorage.from_url(REDIS_URL, state_ttl=FSM_STATE_TTL or None, data_ttl=FSM_DATA_TTL or None)
+        # Keys are locked in Redis, the database is not involved
+        isolation = storage.create_isolation()
+    elif FSM_STORAGE == "django":
+        storage = DjangoStorage(single_row=FSM_SINGLE_ROW, codec=FSM_STORAGE_CODEC, layout=FSM_STORAGE_LAYOUT)
+        isolation = DjangoEventIsolation(advisory=FSM_ADVISORY_LOCKS)
+    else:
+        raise ValueError(f"Unknown FSM storage: {FSM_STORAGE!r}")
+    if FSM_CACHE_SIZE:
+        storage = CachedStorage(storage, maxsize=FSM_CACHE_SIZE, ttl=FSM_CACHE_TTL)
+    return storage, isolation
+
+
+bot = Bot(
+    token=TG_TOKEN,
+    parse_mode="HTML",
+    session=AiohttpSession(api=TelegramAPIServer.from_base(TG_API_SERVER) if TG_API_SERVER else PRODUCTION),
+)
+if EDIT_CACHE_SIZE:
+    bot.session.middleware(SkipUnmodifiedEditsMiddleware(maxsize=EDIT_CACHE_SIZE))
+storage, events_isolation = _create_storage()
+dispatcher = Dispatcher(
+    storage=storage,
+    events_isolation=events_isolation,
+    # The FSM middleware is registered below, after the anti-flood one
+    disable_fsm=True,
+)
+dispatcher.update.outer_middleware(
+    AntiFloodMiddleware(rate=ANTIFLOOD_RATE, burst=ANTIFLOOD_BURST, cooldown=ANTIFLOOD_COOLDOWN)
+)
+dispatcher.update.outer_middleware(dispatcher.fsm)
+if FSM_WRITE_BUFFER:
+    # Registered after the dispatcher's FSM middleware, so it runs inside of it
+    dispatcher.update.outer_middleware(FSMWriteBufferMiddleware())
+dispatcher.callback_query.outer_middleware(MenuCallbackMiddleware())
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -28,12 +98,15 @@ def _register_routers() -> None:
     dispatcher.include_router(expert_router)
     dispatcher.include_router(manager_router)
     dispatcher.include_router(reg_router)
+    dispatcher.include_router(fallback_router)
 
 
 @dispatcher.startup()
 async def on_startup():
     await bot.delete_webhook(drop_pending_updates=True)
     _register_routers()
+    await deletion_scheduler.start(bot)
+    await outbox.resume(bot)
 
     scheduler = AsyncIOScheduler(timezone="Europe/Moscow")
     scheduler.add_job(Notification.send_notifs, trigger="cron", hour=20,
@@ -51,21 +124,19 @@ async def on_startup():
     scheduler.add_job(Notification.send_notifs, trigger="cron", hour=16,
                       minute=0, start_date=datetime.now(),
                       kwargs={"notif_type": "consultation", "bot": bot})
-    scheduler.add_job(Utils.delete_messages, trigger="cron", hour=23,
-                      minute=55, start_date=datetime.now(),
-                      kwargs={"bot": bot, "next_day": True, "types": ["transfer", "living"]})
-    scheduler.add_job(Utils.delete_messages, trigger="cron", hour=17,
-                      minute=0, start_date=datetime.now(),
-                      kwargs={"bot": bot, "next_day": True, "types": ["activity"]})
-    scheduler.add_job(Utils.delete_messages, trigger="cron", hour=19,
-                      minute=0, start_date=datetime.now(),
-                      kwargs={"bot": bot, "types": ["consultation"]})
-    scheduler.add_job(Utils.delete_messages, trigger="cron", hour=23,
-                      minute=59, start_date=datetime.now(),
-                      kwargs={"bot": bot, "types": ["imenu", "notif", "feedback", "general", "schedule"]})
+    if FSM_STORAGE == "django":
+        scheduler.add_job(DjangoStorage.delete_stale, trigger="cron", hour=4,
+                          minute=0, start_date=datetime.now(),
+                          kwargs={"idle_ttl": timedelta(days=FSM_IDLE_TTL_DAYS)})
     scheduler.start()
 
 
+@dispatcher.shutdown()
+async def on_shutdown():
+    await deletion_scheduler.close()
+    await message_buffer.close()
+
+
 def run_polling() -> None:
     dispatcher.run_polling(bot)
 